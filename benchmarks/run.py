@@ -0,0 +1,200 @@
+# The sample script and documentation are provided AS IS and are not supported by
+# the author or the author's employer, unless otherwise agreed in writing. You bear
+# all risk relating to the use or performance of the sample script and documentation.
+# The author and the author's employer disclaim all express or implied warranties
+# (including, without limitation, any warranties of merchantability, title, infringement
+# or fitness for a particular purpose). In no event shall the author, the author's employer
+# or anyone else involved in the creation, production, or delivery of the scripts be liable
+# for any damages whatsoever arising out of the use or performance of the sample script and
+# documentation (including, without limitation, damages for loss of business profits,
+# business interruption, loss of business information, or other pecuniary loss), even if
+# such person has been advised of the possibility of such damages.
+
+import argparse
+import contextlib
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import build
+from benchmarks import synthetic
+from scripts import yaml_utils
+from scripts.language_handler import JavaHandler
+
+# Parameters of the synthetic trees for each size
+SIZES = {
+    'small': {'versions': 3, 'models': 50, 'depth': 2, 'fanout': 2, 'duplicate_rate': 0.8, 'java_classes': 100},
+    'medium': {'versions': 5, 'models': 200, 'depth': 3, 'fanout': 3, 'duplicate_rate': 0.8, 'java_classes': 400},
+    'large': {'versions': 10, 'models': 500, 'depth': 4, 'fanout': 3, 'duplicate_rate': 0.8, 'java_classes': 1000},
+    # Few versions of long allOf chains, for the tree walks of process_paths rather than the file handling
+    'deep': {'versions': 2, 'models': 600, 'depth': 30, 'fanout': 4, 'duplicate_rate': 0.8, 'java_classes': 400},
+}
+
+
+def _process_paths(tree, prefix, jobs=1):
+    # Models first, then the responses that inline them, the same as a build
+    yaml_utils.process_paths(glob.glob(os.path.join(tree, 'models', prefix + '*')), jobs=jobs)
+    yaml_utils.process_paths(glob.glob(os.path.join(tree, 'responses', prefix + '*')), jobs=jobs)
+
+
+def _rename_array_yaml(tree, prefix, jobs=1):
+    yaml_utils.rename_array_yaml([path for directory in ('models', 'responses', 'specs')
+                                  for path in glob.glob(os.path.join(tree, directory, prefix + '*'))])
+
+
+def _fix_camel_case_issues(tree, prefix, jobs=1):
+    build.fix_camel_case_issues(tree, jobs=jobs)
+
+
+def _remove_duplicate_models(tree, prefix, jobs=1):
+    JavaHandler('flasharray', jobs=jobs)._remove_duplicate_models(os.path.join(tree, 'src'))
+
+
+# Each benchmark is a function of a fresh copy of the tree, and the kind of tree it needs. Builds rename array.yaml
+# after the references have been inlined, so that benchmark runs on a processed tree.
+BENCHMARKS = {
+    'process_paths': (_process_paths, 'swagger'),
+    'rename_array_yaml': (_rename_array_yaml, 'processed'),
+    'fix_camel_case_issues': (_fix_camel_case_issues, 'swagger'),
+    'remove_duplicate_models': (_remove_duplicate_models, 'java'),
+}
+
+
+def _count_files(tree):
+    return sum(len(entries) for _, _, entries in os.walk(tree))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run(function, template, work_dir, jobs):
+    """Run function on a fresh copy of template, returning how long it took. The copy isn't timed."""
+    tree = os.path.join(work_dir, 'run')
+    shutil.copytree(template, tree)
+    try:
+        # The functions print a line per change they make, which would only measure the terminal
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function(tree, 'FA', jobs)
+            return time.perf_counter() - start
+    finally:
+        shutil.rmtree(tree)
+
+
+def run_benchmark(name, size, work_dir, repeat, seed=0, jobs=1, memory=False):
+    """
+    Time one benchmark at one size. Every run works on a fresh copy of the synthetic tree.
+
+    :param jobs: number of processes for the benchmarks that can use several
+    :param memory: also measure the peak memory allocated by this process, with tracemalloc. It slows everything down,
+    so it is measured in a run of its own that isn't timed.
+
+    :return: the result, as a dict
+    """
+    function, kind = BENCHMARKS[name]
+    params = SIZES[size]
+    template = os.path.join(work_dir, f"{kind}-{size}")
+    if not os.path.isdir(template):
+        if kind in ('swagger', 'processed'):
+            synthetic.generate_swagger_tree(template, params['versions'], params['models'], params['depth'],
+                                            params['fanout'], params['duplicate_rate'], seed=seed)
+            if kind == 'processed':
+                _process_paths(template, 'FA')
+        else:
+            synthetic.generate_java_tree(template, params['java_classes'], seed=seed)
+
+    times = [_run(function, template, work_dir, jobs) for _ in range(repeat)]
+    peak_memory = None
+    if memory:
+        tracemalloc.start()
+        try:
+            _run(function, template, work_dir, jobs)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'benchmark': name,
+        'size': size,
+        'jobs': jobs,
+        'params': params,
+        'files': _count_files(template),
+        'times': times,
+        'min': min(times),
+        'median': statistics.median(times),
+        'peak_memory': peak_memory,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the preprocessing and post-processing steps on synthetic trees')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['small', 'medium'],
+                        help='Sizes of tree to run at. Defaults to small and medium.')
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='Benchmarks to run. Defaults to all of them.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs of each benchmark. Defaults to 3.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic trees. Defaults to 0.')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of processes for process_paths, fix_camel_case_issues and '
+                             'remove_duplicate_models. Defaults to 1.')
+    parser.add_argument('--memory', action='store_true',
+                        help='Also measure the peak memory of each benchmark, in an extra run that is not timed.')
+    parser.add_argument('--pure-python-yaml', action='store_true',
+                        help="Don't use libyaml to load and dump yaml files even if it is available.")
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='File to write the results to. Defaults to "benchmark_results.json".')
+    args = parser.parse_args()
+
+    if args.pure_python_yaml:
+        yaml_utils.use_pure_python()
+
+    results = []
+    work_dir = tempfile.mkdtemp()
+    try:
+        for size in args.sizes:
+            for name in args.benchmarks:
+                result = run_benchmark(name, size, work_dir, args.repeat, args.seed, args.jobs, args.memory)
+                line = (f"{name:<25} {size:<8} {result['files']:>7} files  min {result['min']:8.3f}s  "
+                        f"median {result['median']:8.3f}s")
+                if result['peak_memory'] is not None:
+                    line += f"  peak {result['peak_memory'] / 2 ** 20:8.1f} MiB"
+                print(line)
+                results.append(result)
+    finally:
+        shutil.rmtree(work_dir)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'commit': _git_commit(),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'libyaml': yaml.__with_libyaml__ and not args.pure_python_yaml,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'results': results,
+        }, f, indent=2)
+    print("Results written to " + args.output)
+
+
+if __name__ == '__main__':
+    main()
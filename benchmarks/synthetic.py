@@ -0,0 +1,207 @@
+# The sample script and documentation are provided AS IS and are not supported by
+# the author or the author's employer, unless otherwise agreed in writing. You bear
+# all risk relating to the use or performance of the sample script and documentation.
+# The author and the author's employer disclaim all express or implied warranties
+# (including, without limitation, any warranties of merchantability, title, infringement
+# or fitness for a particular purpose). In no event shall the author, the author's employer
+# or anyone else involved in the creation, production, or delivery of the scripts be liable
+# for any damages whatsoever arising out of the use or performance of the sample script and
+# documentation (including, without limitation, damages for loss of business profits,
+# business interruption, loss of business information, or other pecuniary loss), even if
+# such person has been advised of the possibility of such damages.
+
+import argparse
+import os
+import random
+
+# Words used in descriptions. Some of them are the names the camel case fixes replace.
+_WORDS = ['array', 'volume', 'host', 'pod', 'space', 'snapshot', 'the', 'of', 'a', 'used', 'total', 'KMIP', 'DNS',
+          'SNMPAgent', 'APIClient', 'SMI-S', 'SAML2-SSO']
+
+
+def _version_dir(prefix, version):
+    return f"{prefix}2.{version}"
+
+
+def _write(root, path, contents):
+    path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+def _description(rng, words=6):
+    return ' '.join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _properties(rng, count, indent):
+    lines = []
+    for index in range(count):
+        lines.append(f"{indent}prop_{index}:")
+        lines.append(f"{indent}  description: '{_description(rng)}'")
+        lines.append(f"{indent}  type: {rng.choice(['string', 'integer', 'boolean'])}")
+        if rng.random() < 0.3:
+            lines.append(f"{indent}  required: true")
+    return lines
+
+
+def generate_swagger_tree(root, versions=3, models=50, depth=2, fanout=2, duplicate_rate=0.8, prefix='FA', seed=0):
+    """
+    Write a synthetic swagger tree shaped like the FlashArray one: models/<prefix>2.<n>/, responses/<prefix>2.<n>/ and
+    specs/<prefix>2.<n>.spec.yaml for each version.
+
+    Models are built in depth levels. Each model above the bottom level is an allOf of fanout models of the level
+    below plus its own properties, so inlining nests depth levels deep. Every version has an array.yaml model that
+    other models reference, and a response and a path in the spec per top level model.
+
+    :param versions: number of versions
+    :param models: number of models per version
+    :param depth: number of allOf levels
+    :param fanout: number of models each allOf references
+    :param duplicate_rate: fraction of the models that are the same in every version. The others mention their
+    version in their description.
+    :param seed: seed of the random numbers, the same arguments always give the same tree
+    :return: the names of the version directories
+    """
+    rng = random.Random(seed)
+    levels = [[] for _ in range(depth)]
+    for index in range(models):
+        levels[index * depth // models].append(f"model_{index}")
+    shared = set(rng.sample(range(models), int(models * duplicate_rate)))
+    model_sources = {}
+    for level, names in enumerate(levels):
+        for name in names:
+            index = int(name.split('_')[1])
+            lines = []
+            if level > 0 and len(levels[level - 1]) > 0:
+                lines.append('allOf:')
+                for ref in rng.sample(levels[level - 1], min(fanout, len(levels[level - 1]))):
+                    lines.append(f"  - $ref: '{ref}.yaml'")
+                lines.append('  - type: object')
+                lines.append('    properties:')
+                lines.extend(_properties(rng, 3, '      '))
+                if rng.random() < 0.2:
+                    lines.append('      arrays:')
+                    lines.append('        type: array')
+                    lines.append('        items:')
+                    lines.append("          $ref: 'array.yaml'")
+            else:
+                lines.append('type: object')
+                lines.append('properties:')
+                lines.extend(_properties(rng, 5, '  '))
+            model_sources[name] = (index in shared, lines, _description(rng))
+
+    version_dirs = []
+    for version in range(versions):
+        version_dir = _version_dir(prefix, version)
+        version_dirs.append(version_dir)
+        for name, (is_shared, lines, description) in model_sources.items():
+            if not is_shared:
+                description = f"{description} in version 2.{version}"
+            _write(root, os.path.join('models', version_dir, name + '.yaml'),
+                   '\n'.join([f"description: '{description}'"] + lines) + '\n')
+        _write(root, os.path.join('models', version_dir, 'array.yaml'),
+               '\n'.join(['type: object', 'properties:'] + _properties(rng, 5, '  ')) + '\n')
+
+        spec = ['swagger: "2.0"', 'info:', f"  version: 2.{version}", 'paths:']
+        for name in levels[-1]:
+            response = f"{name}_get_response"
+            _write(root, os.path.join('responses', version_dir, response + '.yaml'),
+                   '\n'.join(['type: object',
+                              'allOf:',
+                              f"  - $ref: '../../models/{version_dir}/{levels[0][0]}.yaml'",
+                              '  - properties:',
+                              '      items:',
+                              '        type: array',
+                              '        items:',
+                              f"          $ref: '../../models/{version_dir}/{name}.yaml'"]) + '\n')
+            spec.extend([f"  /{name}:",
+                         '    get:',
+                         '      responses:',
+                         '        200:',
+                         '          schema:',
+                         f"            $ref: '../responses/{version_dir}/{response}.yaml'"])
+        _write(root, os.path.join('specs', version_dir + '.spec.yaml'), '\n'.join(spec) + '\n')
+
+    return version_dirs
+
+
+def generate_java_tree(root, classes=100, duplicate_rate=0.2, product='flasharray', version='2.0', seed=0):
+    """
+    Write a synthetic tree of generated Java sources for one version, with the model and api packages the Java
+    handler produces. A duplicate_rate fraction of the model classes get numbered copies, e.g. Model3Info and
+    Model3Info2, which differ only in their names, the way Swagger Codegen creates them.
+
+    :return: the src directory of the tree, the argument JavaHandler._remove_duplicate_models takes
+    """
+    rng = random.Random(seed)
+    package = f"com.purestorage.rest.{product}.v{version.replace('.', '_')}"
+    model_dir = os.path.join(root, 'src', 'main', 'java', *package.split('.'), 'model')
+    api_dir = os.path.join(root, 'src', 'main', 'java', *package.split('.'), 'api')
+
+    def model_class(name, fields):
+        var = name[0].lower() + name[1:]
+        lines = [f"package {package}.model;", '', 'import java.util.Objects;', 'import java.util.Arrays;', '',
+                 f"public class {name} {{"]
+        for field_type, field in fields:
+            lines.append(f"  private {field_type} {field} = null;")
+        for field_type, field in fields:
+            lines.extend([f"  public {name} {field}({field_type} {field}) {{",
+                          f"    this.{field} = {field};",
+                          '    return this;',
+                          '  }'])
+        lines.extend(['  @Override',
+                      '  public boolean equals(java.lang.Object o) {',
+                      f"    {name} {var} = ({name}) o;",
+                      f"    return Objects.equals(this, {var});",
+                      '  }',
+                      '}'])
+        return '\n'.join(lines) + '\n'
+
+    names = [f"Model{index}Info" for index in range(classes)]
+    for index, name in enumerate(names):
+        fields = [(rng.choice(['String', 'Long', 'Boolean'] + names[:index]), f"field{field}")
+                  for field in range(rng.randint(2, 6))]
+        _write(model_dir, name + '.java', model_class(name, fields))
+        if rng.random() < duplicate_rate:
+            for copy in range(2, rng.randint(3, 4)):
+                _write(model_dir, f"{name}{copy}.java", model_class(f"{name}{copy}", fields))
+
+    model_files = sorted(os.listdir(model_dir))
+    for api in range(max(1, classes // 20)):
+        used = rng.sample(model_files, min(10, len(model_files)))
+        lines = [f"package {package}.api;", '']
+        lines.extend(f"import {package}.model.{os.path.splitext(name)[0]};" for name in used)
+        lines.extend(['', f"public class Api{api} {{"])
+        lines.extend(f"  public {os.path.splitext(name)[0]} get{index}() {{ return null; }}"
+                     for index, name in enumerate(used))
+        lines.append('}')
+        _write(api_dir, f"Api{api}.java", '\n'.join(lines) + '\n')
+
+    return os.path.join(root, 'src')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic swagger or Java source tree for benchmarking')
+    parser.add_argument('target', help='Directory to write the tree to')
+    parser.add_argument('--java', action='store_true', help='Write Java sources instead of a swagger tree.')
+    parser.add_argument('--versions', type=int, default=3, help='Number of versions. Defaults to 3.')
+    parser.add_argument('--models', type=int, default=50, help='Models, or Java classes, per version. Defaults to 50.')
+    parser.add_argument('--depth', type=int, default=2, help='Levels of allOf references. Defaults to 2.')
+    parser.add_argument('--fanout', type=int, default=2, help='References per allOf. Defaults to 2.')
+    parser.add_argument('--duplicate-rate', type=float, default=None,
+                        help='Fraction of models shared by all versions, or of Java classes with numbered '
+                             'duplicates. Defaults to 0.8 and 0.2.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed. Defaults to 0.')
+    args = parser.parse_args()
+
+    if args.java:
+        generate_java_tree(args.target, args.models, 0.2 if args.duplicate_rate is None else args.duplicate_rate,
+                           seed=args.seed)
+    else:
+        generate_swagger_tree(args.target, args.versions, args.models, args.depth, args.fanout,
+                              0.8 if args.duplicate_rate is None else args.duplicate_rate, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
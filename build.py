@@ -11,13 +11,19 @@
 # such person has been advised of the possibility of such damages.
 
 import argparse
-import subprocess
+import contextlib
+import io
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
-import tempfile, shutil, os, re, glob
-import urllib.request
+import tempfile, shutil, os, re
 
-from scripts import yaml_utils
-from scripts.file_utils import replace_text
+from scripts import build_manifest, codegen, instrumentation, jar_cache, parallel, staging, yaml_utils
+from scripts.file_utils import read_file, rewrite_file, write_file
+from scripts.preprocess_cache import DEFAULT_PREPROCESS_CACHE_DIR, PreprocessCache
 from scripts.language_handler import get_language_handler, get_config_file
 
 
@@ -45,116 +51,533 @@ def determine_versions(source_dir, product, versions):
     return versions
 
 
-def fix_camel_case_issues(directory):
-    for entry in os.listdir(directory):
-        filename = os.path.join(directory, entry)
-        if os.path.isfile(filename):
-            _, extension = os.path.splitext(entry)
-            if extension == '.yaml':
-                replace_text(filename, "KMIP", "Kmip")
-                replace_text(filename, "SAML2 SSO", "Saml2Sso")
-                replace_text(filename, "SAML2-SSO", "Saml2Sso")
-                replace_text(filename, "SNMPAgent", "SnmpAgent")
-                replace_text(filename, "APIClient", "ApiClient")
-                replace_text(filename, "SMI-S", "Smis")
-                replace_text(filename, "DNS", "Dns")
+# Names that are spelled inconsistently across the swagger files, and the spelling to use everywhere
+CAMEL_CASE_FIXES = {
+    "KMIP": "Kmip",
+    "SAML2 SSO": "Saml2Sso",
+    "SAML2-SSO": "Saml2Sso",
+    "SNMPAgent": "SnmpAgent",
+    "APIClient": "ApiClient",
+    "SMI-S": "Smis",
+    "DNS": "Dns",
+}
+_CAMEL_CASE_PATTERN = re.compile("|".join(re.escape(name) for name in CAMEL_CASE_FIXES))
+
+
+def _fix_camel_case_files(files):
+    """Apply CAMEL_CASE_FIXES to each of files, returning the number of substitutions made in each"""
+    substitutions = []
+
+    def replace(match):
+        substitutions[-1] += 1
+        return CAMEL_CASE_FIXES[match.group(0)]
+
+    for filename in files:
+        substitutions.append(0)
+        rewrite_file(filename, [(_CAMEL_CASE_PATTERN, replace)])
+    return substitutions
+
+
+def fix_camel_case_issues(directory, files=None, jobs=1):
+    """
+    Apply CAMEL_CASE_FIXES to every yaml file under directory in a single pass per file. Only files that change are
+    written.
+
+    :param files: if given, only fix these files
+    :param jobs: number of processes to fix files on. Each file is rewritten by the process fixing it.
+    :return: the number of substitutions made
+    """
+    if files is None:
+        files = []
+        for root, _, entries in os.walk(directory, followlinks=True):
+            for entry in entries:
+                _, extension = os.path.splitext(entry)
+                if extension == '.yaml':
+                    files.append(os.path.join(root, entry))
+
+    return sum(parallel.map_chunks(_fix_camel_case_files, files, jobs))
+
+
+def preprocess_sources(source_dir, prefix, versions, cache=None, jobs=1, source=None, reference_index=None,
+                       file_hashes=None):
+    """
+    Modify the copy of the swagger files in source_dir so they can be used for code generation: fix camel case
+    issues, inline references in models and responses and rename files named array.yaml. Only the files reachable
+    through $ref from the spec files of the given versions are touched, nothing else is read by code generation.
+
+    :param versions: the versions that are going to be generated
+    :param cache: PreprocessCache to take unchanged files from and to store the newly preprocessed ones in
+    :param jobs: number of processes to preprocess files on
+    :param source: the directory source_dir is a copy of. The $ref graph and the hashes of the files are taken from
+        it rather than from the copy, so that they can be kept between builds. It must not contain symbolic links,
+        or the paths in source and in source_dir don't match
+    :param reference_index: ReferenceIndex of the files in source, a new one if not given
+    :param file_hashes: FileHashes of the files in source, a new one if not given
+    """
+    root = os.path.realpath(source_dir)
+    source_root = os.path.realpath(source if source is not None else source_dir)
+    if reference_index is None:
+        reference_index = yaml_utils.ReferenceIndex()
+    if file_hashes is None:
+        file_hashes = build_manifest.FileHashes()
+
+    def staged(source_files):
+        # Files outside of source have no copy in source_dir
+        relative_paths = (os.path.relpath(file, source_root) for file in source_files)
+        return set(os.path.join(root, path) for path in relative_paths if not path.startswith(os.pardir))
+
+    def original(file):
+        return os.path.join(source_root, os.path.relpath(file, root))
+
+    spec_files = [os.path.join(source_root, 'specs', f"{prefix}{version}.spec.yaml") for version in versions]
+    with instrumentation.stage("find reachable files"):
+        files = sorted(staged(reference_index.closure(spec_files)))
+    print(f"  {len(files)} swagger files are used by versions {versions}")
+
+    def in_directory(directory):
+        directory = os.path.join(os.path.realpath(source_dir), directory, '')
+        return set(file for file in files
+                   if file.startswith(directory) and os.path.relpath(file, directory).startswith(prefix))
+
+    model_files = in_directory('models')
+    response_files = in_directory('responses')
+    rename_files = model_files | response_files | in_directory('specs')
+
+    stale = {}
+    cached = {}
+    if cache is None:
+        stale = {file: None for file in files}
+    else:
+        with instrumentation.stage("read preprocess cache"):
+            for file in files:
+                steps = ['camel_case']
+                inputs = [original(file)]
+                if file in model_files or file in response_files:
+                    # The output of these depends on the files they inline
+                    steps.append('process_paths')
+                    inputs = reference_index.closure(inputs)
+                if file in rename_files:
+                    steps.append('rename_array_yaml')
+                key = cache.key(os.path.relpath(file, root), steps,
+                                [(os.path.relpath(input_file, source_root), file_hashes.get(input_file))
+                                 for input_file in inputs])
+                contents = cache.get(key)
+                if contents is None:
+                    stale[file] = key
+                else:
+                    cached[file] = contents
+        print(f"  Reused {len(cached)} of {len(files)} preprocessed files from cache")
+
+    def restore_cached(restore_files):
+        for file in restore_files:
+            if file in cached:
+                write_file(file, cached.pop(file))
 
-        elif os.path.isdir(filename):
-            fix_camel_case_issues(filename)
+    print("Fixing camel case issues")
+    # Inlining reads the files referenced by the files being processed, so they need fixing as well
+    fix_files = staged(reference_index.closure(original(file) for file in stale)) if len(cached) > 0 else stale
+    with instrumentation.stage("fix camel case issues"):
+        substitutions = fix_camel_case_issues(source_dir, sorted(fix_files), jobs)
+    print(f"  Made {substitutions} substitutions")
+
+    # Process the yaml files for models and responses to make them work correctly with code generation. Responses
+    # inline the models as they are after processing, so cached models are put in place before the responses are
+    # processed, and cached responses only afterwards. Everything a file references is reachable as well, so
+    # passing only the reachable files treats every file that gets loaded the same as passing whole directories.
+    print("Fixing references in models and responses")
+    with instrumentation.stage("process models"):
+        shared = yaml_utils.process_paths(sorted(model_files), only=stale, jobs=jobs)
+        restore_cached(model_files)
+    with instrumentation.stage("process responses"):
+        shared += yaml_utils.process_paths(sorted(response_files), only=stale, jobs=jobs)
+        restore_cached(list(cached))
+    processed = len((model_files | response_files) & set(stale))
+    if processed > 0:
+        print(f"  Shared the output of {shared} of {processed} files with another version "
+              f"({100 * shared // processed}%)")
+
+    print("Renaming files named 'array.yaml'")
+    with instrumentation.stage("rename array.yaml"):
+        yaml_utils.rename_array_yaml(sorted(rename_files), only=stale)
+
+    if cache is not None:
+        with instrumentation.stage("write preprocess cache"):
+            for file, key in stale.items():
+                if file in rename_files and os.path.basename(file) == 'array.yaml':
+                    file = os.path.join(os.path.dirname(file), 'arrays.yaml')
+                cache.put(key, read_file(file))
+
+
+class _ThreadOutput(io.TextIOBase):
+    """
+    Stand-in for sys.stdout while versions are built in parallel. Threads that have a buffer attached write into it
+    so that each version's log can be printed in one piece, everything else goes straight to the real stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def _built_versions(build_output_root_dir, common_dir):
+    """The versions in the target directory that have a manifest, sorted"""
+    if not os.path.isdir(build_output_root_dir):
+        return []
+    return sorted(entry for entry in os.listdir(build_output_root_dir)
+                  if os.path.join(build_output_root_dir, entry) != common_dir and
+                  build_manifest.read_manifest(os.path.join(build_output_root_dir, entry)) is not None)
+
+
+def _common_manifest(version, manifests, build_output_root_dir):
+    """
+    Manifest of the common artifact when extracted from version: the manifest of that version, as computed by this
+    build or else as left in the target by an earlier one
+    """
+    manifest = manifests.get(version) or build_manifest.read_manifest(os.path.join(build_output_root_dir, version))
+    return {'format': build_manifest.MANIFEST_FORMAT, 'version': version, 'manifest': manifest}
+
+
+def _build_versions_parallel(versions, jobs, build_version):
+    """
+    Run build_version for each version on a pool of jobs threads. The logs of each version are printed in version
+    order once it has finished.
+    """
+    stdout = sys.stdout
+    output = _ThreadOutput(stdout)
+
+    def run(version):
+        output.local.buffer = io.StringIO()
+        error = None
+        try:
+            with instrumentation.stage("build version", version=version):
+                build_version(version)
+        except BaseException as e:
+            error = e
+        log = output.local.buffer.getvalue()
+        output.local.buffer = None
+        return log, error
+
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(run, version) for version in versions]
+            for future in futures:
+                log, error = future.result()
+                stdout.write(log)
+                stdout.flush()
+                if error is not None:
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise error
+    finally:
+        sys.stdout = stdout
+
+
+class BuildState:
+    """
+    What a build keeps for the next one in the same process, used by watch mode: the $ref graph and the hashes of the
+    source files, and the codegen backend along with anything it keeps running. Files that change in between have to
+    be passed to forget().
+    """
+    def __init__(self):
+        self.reference_index = yaml_utils.ReferenceIndex()
+        self.file_hashes = build_manifest.FileHashes()
+        self.backend = None
+
+    def forget(self, files):
+        self.reference_index.forget(files)
+        self.file_hashes.forget(files)
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
 
 
 def build(source: str, build_output_root_dir: str, product: str, language: str, versions: List[str],
-          swagger_jar_url: str, java_binary: str, artifact_version: str):
+          swagger_jar_url: str, java_binary: str, artifact_version: str, jobs: int = 1, swagger_jar: str = None,
+          swagger_jar_sha256: str = None, jar_cache_dir: str = jar_cache.DEFAULT_CACHE_DIR, offline: bool = False,
+          handler_options: dict = None, preprocess_cache: PreprocessCache = None, codegen_timeout: float = None,
+          codegen_log_dir: str = None, codegen_backend: str = 'subprocess', state: BuildState = None):
 
     prefix = get_product_prefix(product)
-    launguage_handler = get_language_handler(product, language)
+    launguage_handler = get_language_handler(product, language, jobs=jobs, **(handler_options or {}))
 
 
     # Copy source files to temporary location
     working_dir = tempfile.mkdtemp()
     print("Working in directory: " + working_dir)
 
-    print("Downloading " + swagger_jar_url)
-    swagger_jar = os.path.join(working_dir, 'swagger-codegen-cli.jar')
-    urllib.request.urlretrieve(swagger_jar_url, swagger_jar)
+    with instrumentation.stage("get swagger jar"):
+        if swagger_jar is not None:
+            print("Using " + swagger_jar)
+            jar_cache.verify_jar(swagger_jar, swagger_jar_sha256)
+        else:
+            swagger_jar = jar_cache.get_swagger_jar(swagger_jar_url, jar_cache_dir, swagger_jar_sha256, offline)
 
     source_dir = os.path.join(working_dir, 'source')
     config_dir = os.path.join(working_dir, 'config')
+    codegen_log_dir = codegen_log_dir or os.path.join(working_dir, 'logs')
 
-    print("Making a copy of the swagger files")
-    shutil.copytree(source, source_dir, dirs_exist_ok=True)
-
-    versions = determine_versions(source_dir, product, versions)
+    versions = determine_versions(source, product, versions)
     versions.sort()
+
+    # The versions earlier builds left in the target, and the artifact they share. That one is extracted from the
+    # lowest version in the target, so that it is the same however the versions in there came to be built.
+    common_dir = launguage_handler.common_dir(build_output_root_dir)
+    built_versions = _built_versions(build_output_root_dir, common_dir)
+    common_manifest = build_manifest.read_manifest(common_dir) if common_dir is not None else None
+    hoisted_versions = [version for version in (common_manifest or {}).get('hoisted_versions', [])
+                        if version in built_versions]
+    # Hoisting moves the classes shared by all versions out of each of them, so every version's output depends on
+    # which versions are built and has to be rebuilt along with any other. The hoisted classes are used by every
+    # version in the target, so all of those are hoisted together.
+    hoist_common_models = (handler_options or {}).get('hoist_common_models', False)
+    if hoist_common_models and len(set(built_versions) - set(versions)) > 0:
+        added_versions = sorted(set(built_versions) - set(versions))
+        missing = [version for version in added_versions
+                   if not os.path.isfile(os.path.join(source, 'specs', f"{prefix}{version}.spec.yaml"))]
+        if len(missing) > 0:
+            shutil.rmtree(working_dir)
+            raise Exception("Can't hoist model classes across versions " + str(missing) + " in "
+                            + build_output_root_dir + ", they have no spec file in " + source)
+        print("Adding versions " + str(added_versions) + ", model classes are hoisted across every version in "
+              + build_output_root_dir)
+        versions = sorted(versions + added_versions)
     print("Generating config for versions: " + str(versions))
 
     os.mkdir(config_dir)
-    launguage_handler.generate_configs(config_dir, language, versions, artifact_version)
-    print("Fixing camel case issues")
-    fix_camel_case_issues(source_dir)
-
-    # Process the yaml files for models and responses to make them work correctly with code generation
-    print("Fixing references in models and responses")
-    yaml_utils.process_paths(glob.glob(os.path.join(source_dir, 'models', prefix + '*')))
-    yaml_utils.process_paths(glob.glob(os.path.join(source_dir, 'responses', prefix + '*')))
-
-    print("Renaming files named 'array.yaml'")
-    yaml_utils.rename_array_yaml(glob.glob(os.path.join(source_dir, 'models', prefix + '*')))
-    yaml_utils.rename_array_yaml(glob.glob(os.path.join(source_dir, 'responses', prefix + '*')))
-    yaml_utils.rename_array_yaml(glob.glob(os.path.join(source_dir, 'specs', prefix + '*')))
-
-    first_version = True
-
-    for version in versions:
+    with instrumentation.stage("generate configs"):
+        launguage_handler.generate_configs(config_dir, language, versions, artifact_version)
+
+    # Work out which versions need building from the manifests of the previous builds
+    settings = {'product': product, 'language': language, 'artifact_version': artifact_version,
+                'handler_options': handler_options or {}}
+    if hoist_common_models:
+        settings['versions'] = versions
+    # The other backends all run the same Swagger Codegen, but the output of the stub has to be rebuilt for real
+    if codegen_backend == 'stub':
+        settings['codegen_backend'] = codegen_backend
+    manifests = {}
+    reference_index = state.reference_index if state is not None else yaml_utils.ReferenceIndex()
+    file_hashes = state.file_hashes if state is not None else build_manifest.FileHashes()
+    pending_versions = []
+    up_to_date_versions = []
+    with instrumentation.stage("check manifests"):
+        for version in versions:
+            build_output_dir = os.path.join(build_output_root_dir, f"{version}")
+            spec_file = os.path.join(source, 'specs', f"{prefix}{version}.spec.yaml")
+            manifests[version] = build_manifest.compute_manifest(os.path.realpath(source),
+                                                                 reference_index.closure([spec_file]),
+                                                                 get_config_file(config_dir, version), swagger_jar,
+                                                                 settings, file_hashes)
+            if os.path.isdir(build_output_dir) and len(os.listdir(build_output_dir)) != 0:
+                previous_manifest = build_manifest.read_manifest(build_output_dir)
+                if previous_manifest is None:
+                    print("WARNING: Target directory not empty: " + build_output_dir)
+                    print("WARNING: Skipping version: " + version)
+                    continue
+                if previous_manifest == manifests[version]:
+                    print("Version " + version + " is up to date")
+                    up_to_date_versions.append(version)
+                    continue
+                if previous_manifest.get('finished') is False:
+                    print("Version " + version + " was left unfinished by the previous build, rebuilding "
+                          + build_output_dir)
+                else:
+                    print("Inputs of version " + version + " changed, rebuilding " + build_output_dir)
+            pending_versions.append(version)
+
+    first_version = None
+    common_up_to_date = False
+    if common_dir is not None and len(set(built_versions) | set(pending_versions)) > 0:
+        first_version = sorted(set(built_versions) | set(pending_versions))[0]
+        expected_common_manifest = _common_manifest(first_version, manifests, build_output_root_dir)
+        common_up_to_date = (common_manifest is not None and
+                             {key: common_manifest.get(key) for key in expected_common_manifest}
+                             == expected_common_manifest)
+        if first_version not in pending_versions and not common_up_to_date:
+            if first_version in up_to_date_versions:
+                print("Rebuilding version " + first_version + " as well, " + common_dir + " is extracted from it")
+                up_to_date_versions.remove(first_version)
+                pending_versions = sorted(pending_versions + [first_version])
+            else:
+                print("WARNING: " + common_dir + " is out of date, build version " + first_version
+                      + " to extract it again")
+
+    if hoist_common_models and len(pending_versions) > 0 and len(up_to_date_versions) > 0:
+        print("Rebuilding versions " + str(up_to_date_versions) + " as well, model classes are hoisted across versions")
+        pending_versions = sorted(pending_versions + up_to_date_versions)
+        up_to_date_versions = []
+
+    if common_dir is None and len(pending_versions) > 0:
+        first_version = pending_versions[0]
+
+    # Extracting the common artifact again takes the classes hoisted into it away from the versions still using them
+    if first_version in pending_versions and not hoist_common_models:
+        left_behind = [version for version in hoisted_versions if version not in pending_versions]
+        if len(left_behind) > 0:
+            shutil.rmtree(working_dir)
+            raise Exception("Versions " + str(left_behind) + " use the model classes hoisted into " + common_dir
+                            + ", which is extracted again from version " + first_version + ". Build them along with "
+                            + str(pending_versions) + ", or pass --hoist-common-models.")
+
+    for version in pending_versions:
         build_output_dir = os.path.join(build_output_root_dir, f"{version}")
-        if os.path.isdir(build_output_dir) and len(os.listdir(build_output_dir)) != 0:
-            print("WARNING: Target directory not empty: " + build_output_dir)
-            print("WARNING: Skipping version: " + version)
-            continue
-
-        generator_output_dir = os.path.join(working_dir, f"client_{version}")
-        os.mkdir(generator_output_dir)
-
-        print("Generating client for version " + version)
-        process = [java_binary,
-                   '-DapiTests=false',
-                   '-DmodelTests=false',
-                   '-DapiDocs=false',
-                   '-DmodelDocs=false',
-                   '-jar',
-                   swagger_jar,
-                   'generate',
-                   '-i',
-                   os.path.join(source_dir, 'specs', f"{prefix}{version}.spec.yaml"),
-                   '-o',
-                   generator_output_dir,
-                   '-l',
-                   language,
-                   '-c',
-                   get_config_file(config_dir, version)]
-        print("Running Swagger Codegen with following command: " + " ".join(process))
-        result = subprocess.run(process,
-                                capture_output=True,
-                                text=True)
-
-        try:
-            result.check_returncode()
-        except subprocess.CalledProcessError:
-            print(result.stdout)
-            print(result.stderr)
-            raise
-
-        launguage_handler.post_process(version, generator_output_dir, working_dir, build_output_root_dir, artifact_version,
-                                       first_version)
+        if os.path.isdir(build_output_dir):
+            shutil.rmtree(build_output_dir)
 
-        os.makedirs(build_output_dir)
-        shutil.copytree(generator_output_dir, build_output_dir, dirs_exist_ok=True)
+    if len(pending_versions) == 0:
+        print("Cleaning up")
+        shutil.rmtree(working_dir)
+        return
 
-        print("Generated SDK available at: " + build_output_dir)
-        first_version = False
+    print("Making a copy of the swagger files")
+    with instrumentation.stage("stage sources"):
+        staged = staging.link_tree(source, source_dir)
+    print(f"  Linked {staged['linked']}, reflinked {staged['reflinked']} and copied {staged['copied']} files")
+
+    # One pool of processes for all the steps, however many versions are built side by side
+    with parallel.pool(jobs):
+        with instrumentation.stage("preprocess sources"):
+            if staged['symlinks'] == 0:
+                # The $ref graph and the hashes of the source files are all there is to know about the copy as well
+                preprocess_sources(source_dir, prefix, pending_versions, preprocess_cache, jobs, source,
+                                   reference_index, file_hashes)
+            else:
+                preprocess_sources(source_dir, prefix, pending_versions, preprocess_cache, jobs)
+
+        def build_version(version):
+            generator_output_dir = os.path.join(working_dir, f"client_{version}")
+            os.mkdir(generator_output_dir)
+
+            print("Generating client for version " + version)
+            with instrumentation.stage("codegen", version=version):
+                backend.generate(os.path.join(source_dir, 'specs', f"{prefix}{version}.spec.yaml"),
+                                 get_config_file(config_dir, version), generator_output_dir,
+                                 os.path.join(codegen_log_dir, f"codegen_{version}.log"), version)
+                instrumentation.add_tree_written(generator_output_dir)
+
+            with instrumentation.stage("post process", version=version):
+                launguage_handler.post_process(version, generator_output_dir, working_dir, build_output_root_dir,
+                                               artifact_version, version == first_version)
+
+            # The manifest goes in first so the output only ever appears complete. Hoisting rewrites every version
+            # afterwards, so until it has gone through the manifest is marked unfinished, and a build that fails to
+            # hoist is redone in full by the next one.
+            build_output_dir = os.path.join(build_output_root_dir, f"{version}")
+            manifest = dict(manifests[version], finished=False) if hoist_common_models else manifests[version]
+            with instrumentation.stage("move output", version=version):
+                build_manifest.write_manifest(generator_output_dir, manifest)
+                staging.move_tree(generator_output_dir, build_output_dir)
+
+            print("Generated SDK available at: " + build_output_dir)
+
+        backend = state.backend if state is not None else None
+        if backend is None:
+            backend = codegen.get_codegen_backend(codegen_backend, java_binary, swagger_jar, language, codegen_timeout,
+                                                  jar_cache_dir)
+        if state is not None:
+            state.backend = backend
+        # A backend kept in the state stays up for the next build
+        with backend if state is None else contextlib.nullcontext():
+            if jobs > 1 and len(pending_versions) > 1:
+                _build_versions_parallel(pending_versions, jobs, build_version)
+            else:
+                for version in pending_versions:
+                    with instrumentation.stage("build version", version=version):
+                        build_version(version)
+
+        with instrumentation.stage("finalize"):
+            launguage_handler.finalize(pending_versions, build_output_root_dir, artifact_version)
+            if hoist_common_models:
+                for version in pending_versions:
+                    build_manifest.write_manifest(os.path.join(build_output_root_dir, f"{version}"), manifests[version])
+            # Written last, a common artifact left without one by a failed build is extracted again by the next
+            if common_dir is not None and os.path.isdir(common_dir) and (first_version in pending_versions
+                                                                         or common_up_to_date):
+                if hoist_common_models:
+                    hoisted_versions = pending_versions
+                else:
+                    hoisted_versions = [version for version in hoisted_versions if version not in pending_versions]
+                build_manifest.write_manifest(common_dir,
+                                              dict(_common_manifest(first_version, manifests, build_output_root_dir),
+                                                   hoisted_versions=hoisted_versions))
 
     print("Cleaning up")
-    shutil.rmtree(working_dir)
+    with instrumentation.stage("clean up"):
+        shutil.rmtree(working_dir)
+
+
+def _snapshot(source):
+    """(mtime, size) of each file in the directories of the swagger tree that builds read, keyed by real path"""
+    snapshot = {}
+    for directory in ('specs', 'models', 'responses'):
+        for root, _, entries in os.walk(os.path.join(source, directory)):
+            for entry in entries:
+                filename = os.path.realpath(os.path.join(root, entry))
+                try:
+                    stat = os.stat(filename)
+                except FileNotFoundError:
+                    continue
+                snapshot[filename] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def watch(interval: float = 1.0, **build_args):
+    """
+    Build, then build again whenever files under specs/, models/ or responses/ of the source change, until
+    interrupted. Between builds the $ref graph and hashes of the source files are kept and only updated for the
+    changed files, and the codegen backend keeps running. The manifests pick out the versions whose inputs changed,
+    and only those are preprocessed and regenerated. With a preprocess cache kept in memory, only the changed files
+    and the files referencing them are preprocessed again.
+
+    :param interval: seconds between checks for changes
+    :param build_args: arguments of build()
+    """
+    source = build_args['source']
+    state = BuildState()
+    snapshot = _snapshot(source)
+    try:
+        while True:
+            try:
+                with instrumentation.stage("build"):
+                    build(**build_args, state=state)
+            except Exception:
+                traceback.print_exc()
+                print("ERROR: Build failed, fix the swagger files to build again")
+
+            print(f"Watching {source} for changes, press Ctrl-C to stop")
+            changed = set()
+            while len(changed) == 0:
+                time.sleep(interval)
+                current = _snapshot(source)
+                # Saving several files takes a moment, wait until nothing changed for an interval
+                while current != snapshot:
+                    time.sleep(interval)
+                    latest = _snapshot(source)
+                    if latest == current:
+                        break
+                    current = latest
+                changed = set(file for file in snapshot.keys() | current.keys()
+                              if snapshot.get(file) != current.get(file))
+                snapshot = current
+
+            print(f"{len(changed)} files changed: " +
+                  ", ".join(os.path.relpath(file, os.path.realpath(source)) for file in sorted(changed)[:10]) +
+                  (", ..." if len(changed) > 10 else ""))
+            state.forget(changed)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        state.close()
 
 
 def main():
@@ -172,16 +595,95 @@ def main():
     parser.add_argument('--swagger-gen', '-s', help='URL of swagger-codegen-cli jar file.',
                         default='https://repo1.maven.org/maven2/io/swagger/swagger-codegen-cli/2.4.28/swagger-codegen-cli-2.4.28.jar',
                         required=False)
+    parser.add_argument('--swagger-jar', help='Path of a local swagger-codegen-cli jar file. Skips downloading.',
+                        default=None, required=False)
+    parser.add_argument('--swagger-jar-sha256', help='Expected SHA-256 checksum of the swagger-codegen-cli jar file.',
+                        default=None, required=False)
+    parser.add_argument('--jar-cache-dir', help=f'Directory to cache downloaded jar files in. Defaults to '
+                                                f'"{jar_cache.DEFAULT_CACHE_DIR}".',
+                        default=jar_cache.DEFAULT_CACHE_DIR, required=False)
+    parser.add_argument('--offline', action='store_true', help='Never download, only use cached jar files.',
+                        required=False)
+    parser.add_argument('--preprocess-cache-dir', default=DEFAULT_PREPROCESS_CACHE_DIR, required=False,
+                        help=f'Directory to cache preprocessed swagger files in. Defaults to '
+                             f'"{DEFAULT_PREPROCESS_CACHE_DIR}".')
+    parser.add_argument('--no-preprocess-cache', action='store_true', required=False,
+                        help="Preprocess every swagger file, don't use or update the cache.")
     parser.add_argument('--artifact-version', help='Version of generated artifact', default='1.0.0', required=False)
+    parser.add_argument('--pure-python-yaml', action='store_true', required=False,
+                        help="Don't use libyaml to load and dump yaml files even if it is available.")
+    parser.add_argument('--dedup-dry-run', action='store_true', required=False,
+                        help='Only report the duplicate model classes that would be merged, keep them all.')
+    parser.add_argument('--hoist-common-models', action='store_true', required=False,
+                        help='Move the model classes that are the same in every version built into the common '
+                             'artifact.')
+    parser.add_argument('--jobs', type=int, default=1, required=False,
+                        help='Number of versions to generate and post-process concurrently, and of processes to '
+                             'preprocess the swagger files on. Defaults to 1.')
+    parser.add_argument('--codegen-timeout', type=float, default=None, required=False,
+                        help='Seconds to wait for Swagger Codegen to generate a version before giving up. Defaults to '
+                             'no limit.')
+    parser.add_argument('--codegen-backend', choices=codegen.CODEGEN_BACKENDS, default='subprocess', required=False,
+                        help='How to run Swagger Codegen: a new Java process per version ("subprocess"), long-lived '
+                             'Java processes generating one version after the other ("worker"), or a stub writing a '
+                             'small fixed client without Java ("stub"). Defaults to "subprocess".')
+    parser.add_argument('--codegen-log-dir', default=None, required=False,
+                        help='Directory to keep the Swagger Codegen output of each version in. Defaults to the '
+                             'temporary working directory.')
+    parser.add_argument('--watch', action='store_true', required=False,
+                        help='Keep running and build again whenever the swagger files change.')
+    parser.add_argument('--watch-interval', type=float, default=1.0, required=False,
+                        help='Seconds between checks for changed swagger files in watch mode. Defaults to 1.')
+    parser.add_argument('--timings-file', default=None, required=False,
+                        help='Write the time, CPU, memory and file I/O of each build stage to this JSON file.')
+    parser.add_argument('--trace-file', default=None, required=False,
+                        help='Write the build stages to this file in the Chrome trace format.')
 
     args = parser.parse_args()
 
-    if not os.path.isfile(args.java_binary):
+    if args.codegen_backend != 'stub' and not os.path.isfile(args.java_binary):
         print("ERROR: --java-binary must be a path to a java executable")
         exit(1)
 
-    build(args.source, args.target, args.product, args.language, args.versions, args.swagger_gen, args.java_binary,
-          args.artifact_version)
+    if args.jobs < 1:
+        print("ERROR: --jobs must be at least 1")
+        exit(1)
+
+    if args.pure_python_yaml:
+        yaml_utils.use_pure_python()
+
+    if args.swagger_jar is not None and not os.path.isfile(args.swagger_jar):
+        print("ERROR: --swagger-jar must be a path to a swagger-codegen-cli jar file")
+        exit(1)
+
+    if args.timings_file is not None or args.trace_file is not None:
+        instrumentation.enable()
+
+    # Watch mode keeps the preprocessed files in memory, along with the cache directory unless that is disabled
+    preprocess_cache = None
+    if args.watch or not args.no_preprocess_cache:
+        preprocess_cache = PreprocessCache(None if args.no_preprocess_cache else args.preprocess_cache_dir,
+                                           keep_in_memory=args.watch)
+    build_args = {
+        'source': args.source, 'build_output_root_dir': args.target, 'product': args.product,
+        'language': args.language, 'versions': args.versions, 'swagger_jar_url': args.swagger_gen,
+        'java_binary': args.java_binary, 'artifact_version': args.artifact_version, 'jobs': args.jobs,
+        'swagger_jar': args.swagger_jar, 'swagger_jar_sha256': args.swagger_jar_sha256,
+        'jar_cache_dir': args.jar_cache_dir, 'offline': args.offline,
+        'handler_options': {'dedup_dry_run': args.dedup_dry_run, 'hoist_common_models': args.hoist_common_models},
+        'preprocess_cache': preprocess_cache, 'codegen_timeout': args.codegen_timeout,
+        'codegen_log_dir': args.codegen_log_dir, 'codegen_backend': args.codegen_backend,
+    }
+
+    try:
+        if args.watch:
+            watch(args.watch_interval, **build_args)
+        else:
+            with instrumentation.stage("build"):
+                build(**build_args)
+    finally:
+        if instrumentation.enabled():
+            instrumentation.write(args.timings_file, args.trace_file)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,68 @@
+// The sample script and documentation are provided AS IS and are not supported by
+// the author or the author's employer, unless otherwise agreed in writing. You bear
+// all risk relating to the use or performance of the sample script and documentation.
+// The author and the author's employer disclaim all express or implied warranties
+// (including, without limitation, any warranties of merchantability, title, infringement
+// or fitness for a particular purpose). In no event shall the author, the author's employer
+// or anyone else involved in the creation, production, or delivery of the scripts be liable
+// for any damages whatsoever arising out of the use or performance of the sample script and
+// documentation (including, without limitation, damages for loss of business profits,
+// business interruption, loss of business information, or other pecuniary loss), even if
+// such person has been advised of the possibility of such damages.
+
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.jar.JarFile;
+
+/**
+ * Runs Swagger Codegen command lines read from stdin one after the other in the same JVM, so that JVM startup, class
+ * loading and JIT warmup are only paid once. Used by the worker backend of scripts/codegen.py.
+ *
+ * Each job is its command line arguments, one per line, followed by an empty line. Everything Swagger Codegen prints
+ * goes to stdout, followed by a line with DONE_MARKER and the exit status of the job: 0 if it succeeded, 1 if it
+ * threw an exception. The worker exits when stdin is closed.
+ *
+ * Usage: java -cp swagger-codegen-cli.jar:classes CodegenWorker swagger-codegen-cli.jar
+ */
+public class CodegenWorker {
+    static final String DONE_MARKER = "##codegen-worker-done## ";
+
+    public static void main(String[] args) throws Exception {
+        String mainClass;
+        try (JarFile jar = new JarFile(args[0])) {
+            mainClass = jar.getManifest().getMainAttributes().getValue("Main-Class");
+        }
+        Method codegenMain = Class.forName(mainClass).getMethod("main", String[].class);
+
+        // A single stream, so that the logs of a job always come before its marker
+        PrintStream out = System.out;
+        System.setErr(out);
+
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        List<String> job = new ArrayList<>();
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (!line.isEmpty()) {
+                job.add(line);
+                continue;
+            }
+            int status = 0;
+            try {
+                codegenMain.invoke(null, (Object) job.toArray(new String[0]));
+            } catch (InvocationTargetException e) {
+                e.getCause().printStackTrace();
+                status = 1;
+            }
+            job.clear();
+            out.flush();
+            out.println(DONE_MARKER + status);
+            out.flush();
+        }
+    }
+}
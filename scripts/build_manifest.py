@@ -0,0 +1,95 @@
+# The sample script and documentation are provided AS IS and are not supported by
+# the author or the author's employer, unless otherwise agreed in writing. You bear
+# all risk relating to the use or performance of the sample script and documentation.
+# The author and the author's employer disclaim all express or implied warranties
+# (including, without limitation, any warranties of merchantability, title, infringement
+# or fitness for a particular purpose). In no event shall the author, the author's employer
+# or anyone else involved in the creation, production, or delivery of the scripts be liable
+# for any damages whatsoever arising out of the use or performance of the sample script and
+# documentation (including, without limitation, damages for loss of business profits,
+# business interruption, loss of business information, or other pecuniary loss), even if
+# such person has been advised of the possibility of such damages.
+
+import functools
+import glob
+import hashlib
+import json
+import os
+
+from scripts.file_utils import write_file
+from scripts.jar_cache import file_sha256
+
+# Written into each version's output directory. Records a hash of everything the generated client depends on.
+MANIFEST_FILE = '.build-manifest.json'
+MANIFEST_FORMAT = 1
+
+
+class FileHashes:
+    """SHA-256 of files, each computed at most once"""
+    def __init__(self):
+        self._hashes = {}
+
+    def get(self, filename):
+        filename = os.path.realpath(filename)
+        if filename not in self._hashes:
+            self._hashes[filename] = file_sha256(filename)
+        return self._hashes[filename]
+
+    def forget(self, files):
+        """Drop the hashes of the given files, e.g. because they changed"""
+        for filename in files:
+            self._hashes.pop(os.path.realpath(filename), None)
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """
+    Hash of the generator's own code. Any change to the preprocessing or the language handlers changes it, so
+    outputs built by an older version of the scripts are rebuilt.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.sha256()
+    for filename in sorted([os.path.join(root, 'build.py')] + glob.glob(os.path.join(root, 'scripts', '*.py'))):
+        digest.update(os.path.relpath(filename, root).encode('utf-8'))
+        digest.update(file_sha256(filename).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def compute_manifest(source_dir, input_files, config_file, swagger_jar, settings, file_hashes=None):
+    """
+    Describe the inputs of one version's build
+
+    :param source_dir: root of the swagger files
+    :param input_files: the version's spec file and every model and response file it references
+    :param config_file: the generated codegen config for the version
+    :param swagger_jar: the swagger-codegen-cli jar
+    :param settings: anything else the output depends on, e.g. product, language and handler options. Must be JSON
+    serializable.
+    :param file_hashes: FileHashes to share hashes between versions
+    :return: the manifest, as a dict
+    """
+    file_hashes = file_hashes or FileHashes()
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'code': code_version(),
+        'settings': settings,
+        'swagger_jar': file_hashes.get(swagger_jar),
+        'config': file_hashes.get(config_file),
+        'inputs': {os.path.relpath(file, source_dir).replace(os.sep, '/'): file_hashes.get(file)
+                   for file in sorted(input_files)},
+    }
+    # Round trip through JSON so that it compares equal to a manifest read back from disk
+    return json.loads(json.dumps(manifest))
+
+
+def read_manifest(output_dir):
+    """The manifest stored in output_dir, or None if there isn't a readable one"""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(output_dir, manifest):
+    write_file(os.path.join(output_dir, MANIFEST_FILE), json.dumps(manifest, indent=2, sort_keys=True) + '\n')
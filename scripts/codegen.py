@@ -0,0 +1,419 @@
+# The sample script and documentation are provided AS IS and are not supported by
+# the author or the author's employer, unless otherwise agreed in writing. You bear
+# all risk relating to the use or performance of the sample script and documentation.
+# The author and the author's employer disclaim all express or implied warranties
+# (including, without limitation, any warranties of merchantability, title, infringement
+# or fitness for a particular purpose). In no event shall the author, the author's employer
+# or anyone else involved in the creation, production, or delivery of the scripts be liable
+# for any damages whatsoever arising out of the use or performance of the sample script and
+# documentation (including, without limitation, damages for loss of business profits,
+# business interruption, loss of business information, or other pecuniary loss), even if
+# such person has been advised of the possibility of such damages.
+
+import collections
+import hashlib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from scripts import jar_cache
+
+# Number of lines of the output kept in memory, and printed if Swagger Codegen fails
+TAIL_LINES = 50
+# Seconds between progress messages
+PROGRESS_INTERVAL = 10
+# Options of the JVM running Swagger Codegen, which stop it generating tests and docs
+JVM_OPTIONS = ['-DapiTests=false', '-DmodelTests=false', '-DapiDocs=false', '-DmodelDocs=false']
+
+CODEGEN_BACKENDS = ('subprocess', 'worker', 'stub')
+
+_WORKER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CodegenWorker.java')
+# Printed by the worker after the output of each job, followed by the exit status. Kept in sync with CodegenWorker.
+_DONE_MARKER = '##codegen-worker-done## '
+
+
+class _CodegenLog:
+    """
+    The output of one Swagger Codegen run, written to a log file line by line. Only the last lines are kept in memory,
+    to be printed if it fails. Progress is printed as the files are written.
+    """
+    def __init__(self, log_file, name='', tail_lines=TAIL_LINES, progress_interval=PROGRESS_INTERVAL):
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        self.log_file = log_file
+        self.log = open(log_file, 'w')
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.name = name
+        self.progress_interval = progress_interval
+        self.last_progress = time.monotonic()
+        self.files_written = 0
+
+    def write(self, line):
+        self.log.write(line)
+        self.tail.append(line)
+        if 'writing file' in line:
+            self.files_written += 1
+            if time.monotonic() - self.last_progress >= self.progress_interval:
+                # Printed by the thread reading the output so it shows straight away, even while versions are built
+                # in parallel
+                print(f"  {self.name}: {self.files_written} files written")
+                self.last_progress = time.monotonic()
+
+    def close(self):
+        self.log.close()
+
+    def print_tail(self):
+        print(''.join(self.tail), end='')
+
+
+def _kill(process):
+    """Kill process and anything it started, it must have been started in a process group of its own"""
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        process.kill()
+    process.wait()
+
+
+def run_codegen(process, log_file, timeout=None, name='', tail_lines=TAIL_LINES, progress_interval=PROGRESS_INTERVAL):
+    """
+    Run Swagger Codegen, streaming its output to log_file line by line. Only the last lines are kept in memory, to be
+    printed if it fails. Progress is printed as the files are written.
+
+    :param process: the command line
+    :param log_file: file to write stdout and stderr to
+    :param timeout: seconds to wait before killing it, None to wait forever
+    :param name: prefix of the progress messages, e.g. the version
+    :return: the number of files written
+    """
+    output = _CodegenLog(log_file, name, tail_lines, progress_interval)
+
+    # In a process group of its own, so that anything it starts is killed along with it
+    child = subprocess.Popen(process, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace',
+                             start_new_session=True)
+
+    def read_output():
+        try:
+            for line in child.stdout:
+                output.write(line)
+        finally:
+            output.close()
+
+    reader = threading.Thread(target=read_output, daemon=True)
+    reader.start()
+    try:
+        returncode = child.wait(timeout)
+    except subprocess.TimeoutExpired:
+        _kill(child)
+        reader.join(1)
+        output.print_tail()
+        raise Exception(f"Swagger Codegen did not finish within {timeout} seconds, output in {log_file}")
+    except BaseException:
+        _kill(child)
+        raise
+    reader.join()
+
+    print(f"  Swagger Codegen wrote {output.files_written} files, output in {log_file}")
+    if returncode != 0:
+        output.print_tail()
+        raise subprocess.CalledProcessError(returncode, process)
+    return output.files_written
+
+
+class CodegenBackend:
+    """
+    Runs Swagger Codegen for each version. Backends are context managers, leaving the context stops anything they
+    keep running between versions. generate() may be called from several threads at once.
+    """
+    def __init__(self, java_binary, swagger_jar, language, timeout=None):
+        """
+        :param timeout: seconds to wait for each version before giving up, None to wait forever
+        """
+        self.java_binary = java_binary
+        self.swagger_jar = swagger_jar
+        self.language = language
+        self.timeout = timeout
+
+    def _generate_args(self, spec_file, config_file, output_dir):
+        """The arguments of the swagger-codegen-cli generate command"""
+        return ['generate', '-i', spec_file, '-o', output_dir, '-l', self.language, '-c', config_file]
+
+    def generate(self, spec_file, config_file, output_dir, log_file, name=''):
+        """
+        Generate the client of one version
+
+        :param spec_file: the preprocessed spec file of the version
+        :param config_file: the config file of the version
+        :param output_dir: directory to generate into
+        :param log_file: file to write the output of Swagger Codegen to
+        :param name: prefix of the progress messages, e.g. the version
+        :return: the number of files written
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class SubprocessBackend(CodegenBackend):
+    """Runs a new swagger-codegen-cli process for each version"""
+    def generate(self, spec_file, config_file, output_dir, log_file, name=''):
+        process = [self.java_binary] + JVM_OPTIONS + ['-jar', self.swagger_jar] + \
+            self._generate_args(spec_file, config_file, output_dir)
+        print("Running Swagger Codegen with following command: " + " ".join(process))
+        return run_codegen(process, log_file, self.timeout, name)
+
+
+class _Worker:
+    """A JVM running CodegenWorker, which runs the jobs written to its stdin one at a time"""
+    def __init__(self, process):
+        # In a process group of its own, so that anything it starts is killed along with it
+        self.process = subprocess.Popen(process, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, text=True, errors='replace', start_new_session=True)
+        self.output = None
+        self.status = None
+        self.done = threading.Event()
+        # Anything printed outside of a job, e.g. JVM warnings, printed if the worker exits
+        self.tail = collections.deque(maxlen=TAIL_LINES)
+        self.jobs = 0
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+
+    def _read_output(self):
+        for line in self.process.stdout:
+            if line.startswith(_DONE_MARKER):
+                self.status = int(line[len(_DONE_MARKER):])
+                self.done.set()
+            elif self.output is not None:
+                self.output.write(line)
+            else:
+                self.tail.append(line)
+        # The worker exited, status stays None if it was in the middle of a job
+        self.done.set()
+
+    def run(self, args, output, timeout=None):
+        """
+        Run one job, writing its output to output
+
+        :return: the exit status of the job, None if the worker exited
+        :raises subprocess.TimeoutExpired: if the job didn't finish within timeout seconds
+        """
+        self.output = output
+        self.status = None
+        self.done.clear()
+        self.jobs += 1
+        try:
+            self.process.stdin.write(''.join(arg + '\n' for arg in args) + '\n')
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            self.reader.join()
+            return None
+        if not self.done.wait(timeout):
+            raise subprocess.TimeoutExpired(args, timeout)
+        self.output = None
+        return self.status
+
+    def stop(self, timeout=10):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            _kill(self.process)
+        self.reader.join(1)
+
+
+class WorkerBackend(CodegenBackend):
+    """
+    Runs the versions on long-lived JVMs, each loading Swagger Codegen once and then generating one version after the
+    other. A worker is started whenever a version is generated while the others are busy, so there are as many as
+    the number of versions generated concurrently.
+
+    The worker is a small Java class, compiled with the javac of the same JDK as java_binary and cached in cache_dir.
+    """
+    def __init__(self, java_binary, swagger_jar, language, timeout=None, cache_dir=jar_cache.DEFAULT_CACHE_DIR):
+        super().__init__(java_binary, swagger_jar, language, timeout)
+        self.cache_dir = cache_dir
+        self.classes_dir = None
+        self.lock = threading.Lock()
+        self.idle_workers = []
+        self.workers = []
+
+    def _find_javac(self):
+        java_dir = os.path.dirname(os.path.realpath(self.java_binary))
+        javac = 'javac.exe' if sys.platform == 'win32' else 'javac'
+        # Next to java, or in the JDK around the jre directory of Java 8
+        for candidate in (os.path.join(java_dir, javac), os.path.join(java_dir, os.pardir, os.pardir, 'bin', javac)):
+            if os.path.isfile(candidate):
+                return os.path.normpath(candidate)
+        javac = shutil.which(javac)
+        if javac is None:
+            raise Exception("The worker codegen backend needs javac, and it wasn't found next to " + self.java_binary)
+        return javac
+
+    def _compile_worker(self):
+        """Compile CodegenWorker, unless it is in the cache already. :return: the directory containing the class"""
+        javac = self._find_javac()
+        with open(_WORKER_SOURCE, 'rb') as f:
+            key = hashlib.sha256(f.read() + javac.encode()).hexdigest()[:16]
+        classes_dir = os.path.join(self.cache_dir, 'codegen-worker', key)
+        if os.path.isfile(os.path.join(classes_dir, 'CodegenWorker.class')):
+            return classes_dir
+
+        print("Compiling the Swagger Codegen worker with " + javac)
+        os.makedirs(os.path.dirname(classes_dir), exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(classes_dir))
+        try:
+            result = subprocess.run([javac, '-d', temp_dir, _WORKER_SOURCE], stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, text=True)
+            if result.returncode != 0:
+                print(result.stdout, end='')
+                raise Exception("Failed to compile " + _WORKER_SOURCE)
+            try:
+                os.rename(temp_dir, classes_dir)
+            except OSError:
+                # Compiled by another build meanwhile
+                if not os.path.isdir(classes_dir):
+                    raise
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        return classes_dir
+
+    def _get_worker(self):
+        with self.lock:
+            if self.classes_dir is None:
+                self.classes_dir = self._compile_worker()
+            if len(self.idle_workers) > 0:
+                return self.idle_workers.pop()
+            worker = _Worker([self.java_binary] + JVM_OPTIONS +
+                             ['-cp', os.pathsep.join([self.swagger_jar, self.classes_dir]), 'CodegenWorker',
+                              self.swagger_jar])
+            self.workers.append(worker)
+        print(f"Started Swagger Codegen worker {worker.process.pid}")
+        return worker
+
+    def _discard_worker(self, worker):
+        with self.lock:
+            self.workers.remove(worker)
+        _kill(worker.process)
+        worker.reader.join(1)
+
+    def generate(self, spec_file, config_file, output_dir, log_file, name=''):
+        args = self._generate_args(spec_file, config_file, output_dir)
+        for arg in args:
+            if arg == '' or '\n' in arg:
+                raise Exception(f"Can't pass {arg!r} to the Swagger Codegen worker")
+        worker = self._get_worker()
+        print(f"Running Swagger Codegen on worker {worker.process.pid} (job {worker.jobs + 1}): " + " ".join(args))
+
+        output = _CodegenLog(log_file, name)
+        try:
+            status = worker.run(args, output, self.timeout)
+        except subprocess.TimeoutExpired:
+            self._discard_worker(worker)
+            output.print_tail()
+            raise Exception(f"Swagger Codegen did not finish within {self.timeout} seconds, output in {log_file}")
+        except BaseException:
+            self._discard_worker(worker)
+            raise
+        finally:
+            output.close()
+
+        print(f"  Swagger Codegen wrote {output.files_written} files, output in {log_file}")
+        if status is None:
+            self._discard_worker(worker)
+            print(''.join(worker.tail), end='')
+            output.print_tail()
+            raise Exception(f"Swagger Codegen worker {worker.process.pid} exited with status "
+                            f"{worker.process.returncode}, output in {log_file}")
+        with self.lock:
+            self.idle_workers.append(worker)
+        if status != 0:
+            output.print_tail()
+            raise Exception(f"Swagger Codegen failed, output in {log_file}")
+        return output.files_written
+
+    def close(self):
+        with self.lock:
+            workers = list(self.workers)
+            self.workers = []
+            self.idle_workers = []
+        for worker in workers:
+            worker.stop()
+        if len(workers) > 0:
+            print(f"Stopped {len(workers)} Swagger Codegen workers after "
+                  f"{sum(worker.jobs for worker in workers)} versions")
+
+
+class StubBackend(CodegenBackend):
+    """
+    Writes a small fixed Java project for each version instead of running Swagger Codegen, to try out the rest of the
+    build, e.g. the scheduling of the versions, without Java. Only the layout the Java handler expects is known.
+    """
+    def generate(self, spec_file, config_file, output_dir, log_file, name=''):
+        print("Writing a stub client instead of running Swagger Codegen")
+        with open(config_file) as f:
+            config = json.load(f)
+        model_package = config.get('modelPackage', 'model')
+        api_package = config.get('apiPackage', 'api')
+        invoker_package = config.get('invokerPackage', 'invoker')
+
+        def java_file(package, class_name):
+            return os.path.join('src', 'main', 'java', *package.split('.'), class_name + '.java')
+
+        files = {
+            'README.md': '# Stub client\n',
+            'pom.xml': f"<project>\n    <artifactId>{config.get('artifactId', 'client')}</artifactId>\n"
+                       f"    <dependencies>\n    </dependencies>\n</project>\n",
+            java_file(invoker_package, 'JSON'): f"package {invoker_package};\n\nimport {model_package}.*;\n\n"
+                                                f"public class JSON {{\n}}\n",
+            java_file(model_package, 'StubModel'): f"package {model_package};\n\npublic class StubModel {{\n"
+                                                   f"  private String name = null;\n}}\n",
+            java_file(api_package, 'StubApi'): f"package {api_package};\n\nimport {model_package}.StubModel;\n\n"
+                                               f"public class StubApi {{\n"
+                                               f"  public StubModel get() {{ return null; }}\n}}\n",
+            os.path.join('src', 'test', 'java', 'StubTest.java'): 'public class StubTest {\n}\n',
+        }
+
+        output = _CodegenLog(log_file, name)
+        try:
+            output.write(f"[stub] reading {spec_file} and {config_file}\n")
+            for path, contents in files.items():
+                path = os.path.join(output_dir, path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    f.write(contents)
+                output.write(f"[stub] writing file {path}\n")
+        finally:
+            output.close()
+        print(f"  Stub wrote {output.files_written} files, output in {log_file}")
+        return output.files_written
+
+
+def get_codegen_backend(backend, java_binary, swagger_jar, language, timeout=None,
+                        cache_dir=jar_cache.DEFAULT_CACHE_DIR) -> CodegenBackend:
+    """
+    :param backend: one of CODEGEN_BACKENDS
+    :param cache_dir: where the worker backend caches its compiled worker
+    """
+    if backend == 'subprocess':
+        return SubprocessBackend(java_binary, swagger_jar, language, timeout)
+    if backend == 'worker':
+        return WorkerBackend(java_binary, swagger_jar, language, timeout, cache_dir)
+    if backend == 'stub':
+        return StubBackend(java_binary, swagger_jar, language, timeout)
+    raise Exception("Unknown codegen backend: " + backend)
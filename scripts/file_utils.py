@@ -10,12 +10,139 @@
 # business interruption, loss of business information, or other pecuniary loss), even if
 # such person has been advised of the possibility of such damages.
 
+import functools
+import os
 import re
+import shutil
+import tempfile
 
+from scripts import instrumentation
 
-def replace_text(filename, to_replace, replacement):
-    with open(filename, "r") as file:
-        lines = file.readlines()
-    with open(filename, "w") as file:
-        for line in lines:
-            file.write(re.sub(to_replace, replacement, line))
+# Files are treated as UTF-8. Anything that isn't valid UTF-8 survives a rewrite unchanged.
+_ENCODING = 'utf-8'
+_ERRORS = 'surrogateescape'
+
+_SPECIAL_CHARS = set('.^$*+?{}[]|()')
+
+
+def _literal(pattern):
+    """The text matched by pattern if it is a plain string with nothing but escaped punctuation, otherwise None"""
+    literal = []
+    escaped = False
+    for ch in pattern:
+        if escaped:
+            if ch.isalnum():
+                return None
+            literal.append(ch)
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        elif ch in _SPECIAL_CHARS:
+            return None
+        else:
+            literal.append(ch)
+    if escaped:
+        return None
+    return ''.join(literal)
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(pattern):
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    # Patterns used to be applied line by line. MULTILINE keeps ^ and $ meaning the same on the whole file.
+    return re.compile(pattern, re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=None)
+def _prefilter(pattern):
+    """
+    Return a function telling whether pattern may match the raw bytes of a file. It never gives false negatives:
+    bytes regexes only match the same as text regexes on ASCII, so non-ASCII files are always let through unless the
+    pattern is a literal.
+    """
+    compiled = _compile(pattern)
+    if not isinstance(compiled.pattern, str):
+        return lambda data: True
+
+    literal = _literal(compiled.pattern) if compiled.flags & re.IGNORECASE == 0 else None
+    if literal is not None:
+        needle = literal.encode(_ENCODING)
+        return lambda data: needle in data
+
+    if not compiled.pattern.isascii():
+        return lambda data: True
+    try:
+        byte_pattern = re.compile(compiled.pattern.encode('ascii'), compiled.flags & ~re.UNICODE)
+    except re.error:
+        return lambda data: True
+    return lambda data: not data.isascii() or byte_pattern.search(data) is not None
+
+
+def write_file(filename, contents):
+    """
+    Atomically replace filename with contents: the new contents are written to a temporary file in the same directory
+    which is then renamed over filename. The file is given a new inode, so hardlinked copies keep the old contents.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    data = contents.encode(_ENCODING, _ERRORS)
+    instrumentation.add_written(len(data))
+    fd, temp_file = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filename) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if os.path.exists(filename):
+            shutil.copymode(filename, temp_file)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_file, 0o666 & ~umask)
+        os.replace(temp_file, filename)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+def read_file(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    instrumentation.add_read(len(data))
+    return data.decode(_ENCODING, _ERRORS)
+
+
+def update_file(filename, contents):
+    """
+    Write contents to filename unless it already holds exactly that
+
+    :return: True if the file was written
+    """
+    if os.path.isfile(filename) and read_file(filename) == contents:
+        return False
+    write_file(filename, contents)
+    return True
+
+
+def rewrite_file(filename, replacements):
+    """
+    Apply a list of (pattern, replacement) pairs to a file, in order. Patterns are regular expressions, either strings
+    or compiled; replacements are anything re.sub accepts. Files the patterns can't match are skipped after a check
+    of their raw bytes, and the file is only written, atomically, if its contents changed.
+
+    :return: True if the file was changed
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    instrumentation.add_read(len(data))
+    if not any(_prefilter(pattern)(data) for pattern, _ in replacements):
+        return False
+
+    contents = data.decode(_ENCODING, _ERRORS)
+    new_contents = contents
+    for pattern, replacement in replacements:
+        new_contents = _compile(pattern).sub(replacement, new_contents)
+    if new_contents == contents:
+        return False
+
+    write_file(filename, new_contents)
+    return True
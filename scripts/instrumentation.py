@@ -0,0 +1,241 @@
+# The sample script and documentation are provided AS IS and are not supported by
+# the author or the author's employer, unless otherwise agreed in writing. You bear
+# all risk relating to the use or performance of the sample script and documentation.
+# The author and the author's employer disclaim all express or implied warranties
+# (including, without limitation, any warranties of merchantability, title, infringement
+# or fitness for a particular purpose). In no event shall the author, the author's employer
+# or anyone else involved in the creation, production, or delivery of the scripts be liable
+# for any damages whatsoever arising out of the use or performance of the sample script and
+# documentation (including, without limitation, damages for loss of business profits,
+# business interruption, loss of business information, or other pecuniary loss), even if
+# such person has been advised of the possibility of such damages.
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Instrumentation is off unless enable() is called. While it is off, stage() hands out a shared context manager that
+# does nothing and the counting functions return straight away.
+_recorder = None
+_NO_STAGE = contextlib.nullcontext()
+
+_COUNTERS = ('files_read', 'bytes_read', 'files_written', 'bytes_written')
+
+
+def _usage():
+    """CPU seconds and peak RSS in KiB of this process and of its finished child processes"""
+    if resource is None:
+        return 0.0, None, None
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    scale = 1024 if sys.platform == 'darwin' else 1  # ru_maxrss is in bytes on macOS, KiB elsewhere
+    return (children.ru_utime + children.ru_stime,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale, children.ru_maxrss // scale)
+
+
+class _Stage:
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+        self.counters = dict.fromkeys(_COUNTERS, 0)
+        self.worker_cpu_time = 0.0
+
+    def __enter__(self):
+        self.recorder.stack().append(self)
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        self.child_cpu_start, _, _ = _usage()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        cpu = time.thread_time() - self.cpu_start
+        child_cpu, peak_rss, child_peak_rss = _usage()
+        stack = self.recorder.stack()
+        stack.pop()
+        # Anything counted in this stage counts towards the enclosing one as well
+        if len(stack) > 0:
+            for counter, value in self.counters.items():
+                stack[-1].counters[counter] += value
+            stack[-1].worker_cpu_time += self.worker_cpu_time
+        self.recorder.add({
+            'name': self.name,
+            'args': self.args,
+            'thread': threading.current_thread().name,
+            'start': self.start - self.recorder.start,
+            'wall_time': end - self.start,
+            'cpu_time': cpu,
+            'child_cpu_time': child_cpu - self.child_cpu_start,
+            'worker_cpu_time': self.worker_cpu_time,
+            'peak_rss_kib': peak_rss,
+            'child_peak_rss_kib': child_peak_rss,
+            **self.counters,
+        })
+        return False
+
+
+class _Recorder:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stages = []
+        self.totals = dict.fromkeys(_COUNTERS, 0)
+
+    def stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def add(self, record):
+        with self.lock:
+            self.stages.append(record)
+
+    def add_worker_usage(self, usage):
+        stack = self.stack()
+        if len(stack) > 0:
+            for counter in _COUNTERS:
+                stack[-1].counters[counter] += usage[counter]
+            stack[-1].worker_cpu_time += usage['cpu_time']
+        with self.lock:
+            for counter in _COUNTERS:
+                self.totals[counter] += usage[counter]
+
+    def count(self, files_counter, bytes_counter, nbytes):
+        stack = self.stack()
+        if len(stack) > 0:
+            stack[-1].counters[files_counter] += 1
+            stack[-1].counters[bytes_counter] += nbytes
+        with self.lock:
+            self.totals[files_counter] += 1
+            self.totals[bytes_counter] += nbytes
+
+
+def enable():
+    """Start recording stages"""
+    global _recorder
+    _recorder = _Recorder()
+
+
+def enabled():
+    return _recorder is not None
+
+
+def stage(name, **args):
+    """
+    Context manager recording the wall time, CPU time, peak RSS and file I/O of the code it wraps. CPU time is that of
+    the current thread, of the child processes that finished meanwhile, e.g. Swagger Codegen, and of the pool workers
+    that ran work of the stage, see run_in_worker. Stages can be nested.
+
+    :param name: name of the stage
+    :param args: anything identifying this run of the stage, e.g. the version. Must be JSON serializable.
+    """
+    if _recorder is None:
+        return _NO_STAGE
+    return _Stage(_recorder, name, args)
+
+
+def add_read(nbytes):
+    """Count a file read of nbytes bytes"""
+    if _recorder is not None:
+        _recorder.count('files_read', 'bytes_read', nbytes)
+
+
+def add_written(nbytes):
+    """Count a file written with nbytes bytes"""
+    if _recorder is not None:
+        _recorder.count('files_written', 'bytes_written', nbytes)
+
+
+def add_file_read(filename):
+    """Count a read of the whole of filename. The size is only looked up while recording."""
+    if _recorder is not None:
+        _recorder.count('files_read', 'bytes_read', os.path.getsize(filename))
+
+
+def add_tree_written(directory):
+    """Count every file under directory as written, e.g. the output of a subprocess"""
+    if _recorder is not None:
+        for root, _, entries in os.walk(directory):
+            for entry in entries:
+                _recorder.count('files_written', 'bytes_written', os.path.getsize(os.path.join(root, entry)))
+
+
+def run_in_worker(function, *args):
+    """
+    Call function in a worker process of a pool, recording its file I/O and CPU time on their own. Returns its
+    result and the usage to pass to add_worker_usage in the process that handed out the work.
+    """
+    global _recorder
+    _recorder = _Recorder()
+    start = time.process_time()
+    try:
+        result = function(*args)
+        return result, dict(_recorder.totals, cpu_time=time.process_time() - start)
+    finally:
+        _recorder = None
+
+
+def add_worker_usage(usage):
+    """Add the usage of work done by run_in_worker to the current stage, as if it had been done in this thread"""
+    if _recorder is not None:
+        _recorder.add_worker_usage(usage)
+
+
+def summary():
+    """The recorded stages, in the order they finished, and totals per stage name"""
+    by_name = {}
+    for record in _recorder.stages:
+        totals = by_name.setdefault(record['name'], {'count': 0, 'wall_time': 0.0, 'cpu_time': 0.0,
+                                                     'child_cpu_time': 0.0, 'worker_cpu_time': 0.0,
+                                                     **dict.fromkeys(_COUNTERS, 0)})
+        totals['count'] += 1
+        for key in ('wall_time', 'cpu_time', 'child_cpu_time', 'worker_cpu_time') + _COUNTERS:
+            totals[key] += record[key]
+    return {
+        'wall_time': time.perf_counter() - _recorder.start,
+        'peak_rss_kib': _usage()[1],
+        'totals': dict(_recorder.totals),
+        'by_name': by_name,
+        'stages': list(_recorder.stages),
+    }
+
+
+def chrome_trace():
+    """The recorded stages in the Chrome trace event format, for chrome://tracing or https://ui.perfetto.dev"""
+    threads = {}
+    events = []
+    for record in sorted(_recorder.stages, key=lambda record: record['start']):
+        tid = threads.setdefault(record['thread'], len(threads))
+        events.append({
+            'name': record['name'],
+            'ph': 'X',
+            'pid': os.getpid(),
+            'tid': tid,
+            'ts': record['start'] * 1e6,
+            'dur': record['wall_time'] * 1e6,
+            'args': {**{key: value for key, value in record.items() if key not in ('name', 'args', 'thread', 'start')},
+                     **record['args']},
+        })
+    for thread, tid in threads.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': thread}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write(summary_file=None, trace_file=None):
+    """Write the JSON summary and the Chrome trace of the recorded stages to the given files"""
+    if summary_file is not None:
+        with open(summary_file, 'w') as f:
+            json.dump(summary(), f, indent=2)
+    if trace_file is not None:
+        with open(trace_file, 'w') as f:
+            json.dump(chrome_trace(), f)
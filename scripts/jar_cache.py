@@ -0,0 +1,102 @@
+# The sample script and documentation are provided AS IS and are not supported by
+# the author or the author's employer, unless otherwise agreed in writing. You bear
+# all risk relating to the use or performance of the sample script and documentation.
+# The author and the author's employer disclaim all express or implied warranties
+# (including, without limitation, any warranties of merchantability, title, infringement
+# or fitness for a particular purpose). In no event shall the author, the author's employer
+# or anyone else involved in the creation, production, or delivery of the scripts be liable
+# for any damages whatsoever arising out of the use or performance of the sample script and
+# documentation (including, without limitation, damages for loss of business profits,
+# business interruption, loss of business information, or other pecuniary loss), even if
+# such person has been advised of the possibility of such damages.
+
+import hashlib
+import os
+import tempfile
+import urllib.request
+
+# Layout of the cache directory:
+#   jars/<sha256 of contents>.jar   the jar files, named by their checksum
+#   urls/<sha256 of url>            the checksum of the jar last downloaded from that url
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'rest-2-client-generator')
+
+
+def file_sha256(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def _cached_jar(cache_dir, checksum):
+    jar = os.path.join(cache_dir, 'jars', checksum + '.jar')
+    if not os.path.isfile(jar):
+        return None
+    if file_sha256(jar) != checksum:
+        print("WARNING: Discarding corrupt cache entry: " + jar)
+        os.remove(jar)
+        return None
+    return jar
+
+
+def verify_jar(jar, sha256):
+    """Raise if sha256 is given and does not match the contents of jar"""
+    if sha256 is not None and file_sha256(jar) != sha256.lower():
+        raise Exception(f"Checksum mismatch for {jar}: expected {sha256}")
+
+
+def get_swagger_jar(url, cache_dir=DEFAULT_CACHE_DIR, sha256=None, offline=False):
+    """
+    Return the path of a verified copy of the jar at url, downloading it into the cache only if needed
+
+    :param url: URL of the swagger-codegen-cli jar
+    :param cache_dir: directory holding the jar cache
+    :param sha256: expected checksum of the jar. When given, any cached jar with this checksum is used regardless
+    of where it was downloaded from
+    :param offline: never download, fail if the jar is not already cached
+    :return: path of the cached jar
+    """
+    url_file = os.path.join(cache_dir, 'urls', _url_key(url))
+    checksum = sha256.lower() if sha256 is not None else None
+    if checksum is None and os.path.isfile(url_file):
+        with open(url_file) as f:
+            checksum = f.read().strip()
+
+    if checksum is not None:
+        jar = _cached_jar(cache_dir, checksum)
+        if jar is not None:
+            print("Using cached " + url + ": " + jar)
+            return jar
+
+    if offline:
+        raise Exception("Offline mode and no verified copy of " + url + " in cache " + cache_dir)
+
+    jars_dir = os.path.join(cache_dir, 'jars')
+    os.makedirs(jars_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(url_file), exist_ok=True)
+
+    print("Downloading " + url)
+    fd, download = tempfile.mkstemp(dir=jars_dir, suffix='.download')
+    os.close(fd)
+    try:
+        urllib.request.urlretrieve(url, download)
+        actual = file_sha256(download)
+        if sha256 is not None and actual != sha256.lower():
+            raise Exception(f"Checksum mismatch for {url}: expected {sha256}, got {actual}")
+        jar = os.path.join(jars_dir, actual + '.jar')
+        os.replace(download, jar)
+    finally:
+        if os.path.exists(download):
+            os.remove(download)
+
+    fd, url_tmp = tempfile.mkstemp(dir=os.path.dirname(url_file))
+    with os.fdopen(fd, 'w') as f:
+        f.write(actual + '\n')
+    os.replace(url_tmp, url_file)
+
+    return jar
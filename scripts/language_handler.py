@@ -10,17 +10,23 @@
 # business interruption, loss of business information, or other pecuniary loss), even if
 # such person has been advised of the possibility of such damages.
 
-from scripts.file_utils import replace_text
+from scripts import instrumentation, parallel, staging
+from scripts.file_utils import read_file, rewrite_file, write_file
 import shutil, os, re, glob
+import functools
+import hashlib
 import json
 
+# A name in Java source, or a number, as a whole
+_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+
 
 def get_config_file(config_dir, version):
     return os.path.join(config_dir, f"config{version}.json")
 
 
 class LaunguageHandlerBase:
-    def __init__(self, product):
+    def __init__(self, product, **options):
         self.product = product
         pass
 
@@ -37,18 +43,45 @@ class LaunguageHandlerBase:
         :param working_dir: temp directory for staging work
         :param build_output_root_dir: target directory for output packages
         :param artifact_version: version of this artifact for package managers
-        :param first_version: True if this is the first version generated. Useful for tasks that only
-        need to be run once for all versions
+        :param first_version: True for the lowest version in the target directory, if it is being built. Useful for
+        tasks that only need to be run once for all versions, like extracting the artifact in common_dir
 
         :return:
         """
         pass
 
+    def common_dir(self, build_output_root_dir):
+        """
+        The directory of the artifact shared by all versions, which post_process extracts from the first version, or
+        None if there is none
+        """
+        return None
+
+    def finalize(self, versions, build_output_root_dir, artifact_version):
+        """
+        Run any post-processing that needs the output of every version, once all of them have been built
+
+        :param versions: the versions built
+        :param build_output_root_dir: target directory for output packages
+        :param artifact_version: version of this artifact for package managers
+        """
+        pass
+
 
 class JavaHandler(LaunguageHandlerBase):
-    def __init__(self, product):
-        super().__init__(product)
+    def __init__(self, product, dedup_dry_run=False, hoist_common_models=False, jobs=1, **options):
+        """
+        :param dedup_dry_run: only report the duplicate model classes that would be merged, don't change any files
+        :param hoist_common_models: move the model classes that are the same in every version into the common artifact
+        :param jobs: number of processes to fix, fingerprint and rewrite the generated files on
+        """
+        super().__init__(product, **options)
         self.common_artifact_id = f'{self.product}-rest-client-common'
+        self.dedup_dry_run = dedup_dry_run
+        self.hoist_common_models = hoist_common_models
+        self.jobs = jobs
+        # (mtime, size) of each file the compilation fixes have been applied to, keyed by path
+        self._fixed_files = {}
 
     def _get_version_for_package(self, version):
         return f"v{version.replace('.', '_')}"
@@ -62,91 +95,115 @@ class JavaHandler(LaunguageHandlerBase):
     def _get_api_package(self, version):
         return f"com.purestorage.rest.{self.product}.{self._get_version_for_package(version)}.api"
 
+    def _get_common_model_package(self):
+        return f"com.purestorage.rest.{self.product}.common.model"
+
     @staticmethod
-    def _fix_java_compilation_issues(directory):
-        for entry in os.listdir(directory):
-            filename = os.path.join(directory, entry)
-            if os.path.isfile(filename):
-                file, extension = os.path.splitext(entry)
-                if file.startswith('Array') and extension == '.java':
-                    replace_text(filename, r"import java.util.Arrays\;", "")
-                if extension == '.java':
-                    replace_text(filename, r"@javax.annotation.Generated.+", "")
-
-            elif os.path.isdir(filename):
-                JavaHandler._fix_java_compilation_issues(filename)
+    def _get_package_dir(project_dir, package):
+        return os.path.join(project_dir, "src", "main", "java", *package.split('.'))
+
+    def _fix_java_compilation_issues(self, directory):
+        """
+        Apply the Java compilation fixes to the files under directory. Files already fixed are skipped unless they
+        have been modified since.
+
+        :return: the number of files changed
+        """
+        files = []
+        for root, _, entries in os.walk(directory):
+            for entry in entries:
+                if os.path.splitext(entry)[1] != '.java':
+                    continue
+                filename = os.path.realpath(os.path.join(root, entry))
+                stat = os.stat(filename)
+                if self._fixed_files.get(filename) != (stat.st_mtime_ns, stat.st_size):
+                    files.append(filename)
+
+        changed_files = 0
+        for filename, (changed, fixed) in zip(files, parallel.map_chunks(_fix_java_files, files, self.jobs)):
+            changed_files += changed
+            self._fixed_files[filename] = fixed
+        return changed_files
 
     def _add_common_dependency_to_pom(self, pom_file, artifact_version):
-        with open(pom_file, 'r+') as fd:
-            contents = fd.readlines()
-            for index, line in enumerate(contents):
-                if '<dependencies>' in line:
-                    contents.insert(index + 1, '        <dependency>\n')
-                    contents.insert(index + 2, '            <groupId>com.purestorage.rest</groupId>\n')
-                    contents.insert(index + 3, f'            <artifactId>{self.common_artifact_id}</artifactId>\n')
-                    contents.insert(index + 4, f'            <version>{artifact_version}</version>\n')
-                    contents.insert(index + 5, '        </dependency>\n')
-                    break
-            fd.seek(0)
-            fd.writelines(contents)
-
-    def _check_duplicate_class(self, original, duplicate):
-        original_class_name = os.path.basename(original)
-        duplicate_class_name = os.path.basename(duplicate)
-
-        original_var_name = original_class_name[0].lower() + original_class_name[1:]
-        duplicate_var_name = duplicate_class_name[0].lower() + duplicate_class_name[1:]
-
-        with open(original + '.java', 'r') as f:
-            original_contents = f.readlines()
-
-        with open(duplicate + '.java', 'r') as f:
-            duplicate_contents = f.readlines()
-
-        if len(original_contents) != len(duplicate_contents):
-            return False
-
-        for index, original_line in enumerate(original_contents):
-            duplicate_line = duplicate_contents[index]
-            duplicate_line = re.sub(f"([^a-zA-z0-9])({duplicate_class_name})([^a-zA-z0-9])", r"\1" + original_class_name + r"\3", duplicate_line)
-            duplicate_line = re.sub(f"([^a-zA-z0-9])({duplicate_var_name})([^a-zA-z0-9])", r"\1" + original_var_name + r"\3", duplicate_line)
-            if duplicate_line != original_line:
-                print(original_line)
-                print(duplicate_line)
-                return False
-
-        return True
-
-    def _remove_duplicate_class(self, files, original, duplicate, replace_var_names=True):
-        original_class_name = os.path.basename(original)
-        duplicate_class_name = os.path.basename(duplicate)
-
-        original_var_name = original_class_name[0].lower() + original_class_name[1:]
-        duplicate_var_name = duplicate_class_name[0].lower() + duplicate_class_name[1:]
-
-        updated_file_count = 0
-        for fileName, filePath in files.items():
-            if os.path.isfile(filePath):
-                with open(filePath, 'r') as f:
-                    contents = f.readlines()
-                new_contents = []
-                changed = False
-                for index, line in enumerate(contents):
-                    line = re.sub(f"([^a-zA-z0-9])(?<!java\.util\.)({duplicate_class_name})([^a-zA-z0-9])", r"\1" + original_class_name + r"\3", line)
-                    if replace_var_names:
-                        line = re.sub(f"([^a-zA-z0-9\"])({duplicate_var_name})([^a-zA-z0-9\"])", r"\1" + original_var_name + r"\3", line)
-                    if line != contents[index]:
-                        changed = True
-
-                    # These changes can lead to duplicated import statements. Handle that as well
-                    if not line.startswith('import') or index == 0 or line != contents[index - 1]:
-                        new_contents.append(line)
-                if changed:
-                    updated_file_count += 1
-                    with open(filePath, 'w') as f:
-                        f.writelines(new_contents)
-
-        return updated_file_count
+        contents = read_file(pom_file).splitlines(keepends=True)
+        for index, line in enumerate(contents):
+            if '<dependencies>' in line:
+                contents.insert(index + 1, '        <dependency>\n')
+                contents.insert(index + 2, '            <groupId>com.purestorage.rest</groupId>\n')
+                contents.insert(index + 3, f'            <artifactId>{self.common_artifact_id}</artifactId>\n')
+                contents.insert(index + 4, f'            <version>{artifact_version}</version>\n')
+                contents.insert(index + 5, '        </dependency>\n')
+                break
+        write_file(pom_file, ''.join(contents))
+
+    @staticmethod
+    def _class_fingerprint(class_name, contents):
+        """
+        Hash of a class with its own class name and variable name replaced by placeholders, so that classes differing
+        only in their names get the same fingerprint
+        """
+        var_name = class_name[0].lower() + class_name[1:]
+
+        # Class names qualified with java.util are left alone, java.util.Arrays is not a duplicate of Array
+        def replace(match):
+            name = match.group(0)
+            if name == class_name and not contents.endswith('java.util.', 0, match.start()):
+                return '__CLASS__'
+            if name == var_name:
+                return '__VAR__'
+            return name
+
+        normalized = _IDENTIFIER_PATTERN.sub(replace, contents)
+        return hashlib.sha256(normalized.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    @staticmethod
+    def _add_rename(renames, original, duplicate):
+        """Record duplicate -> original, and redirect earlier renames that pointed at duplicate"""
+        for name, target in renames.items():
+            if target == duplicate:
+                renames[name] = original
+        renames[duplicate] = original
+
+    @staticmethod
+    def _compile_renames(class_renames, var_renames):
+        """
+        A single regex matching every class and variable name to be replaced. Class names are not replaced when
+        qualified with java.util (java.util.Arrays is not a duplicate of Array), and variable names are not replaced
+        inside quotes so serialized names are left alone.
+        """
+        alternatives = []
+        if class_renames:
+            names = '|'.join(re.escape(name) for name in sorted(class_renames, key=len, reverse=True))
+            alternatives.append(f"(?<![a-zA-Z0-9_])(?<!java\\.util\\.)(?P<cls>{names})(?![a-zA-Z0-9_])")
+        if var_renames:
+            names = '|'.join(re.escape(name) for name in sorted(var_renames, key=len, reverse=True))
+            alternatives.append(f"(?<![a-zA-Z0-9_\"])(?P<var>{names})(?![a-zA-Z0-9_\"])")
+        return re.compile('|'.join(alternatives)) if alternatives else None
+
+    @staticmethod
+    def _apply_renames(pattern, class_renames, var_renames, contents):
+        if pattern is None:
+            return contents
+
+        def replace(match):
+            if match.group('cls') is not None:
+                return class_renames[match.group('cls')]
+            return var_renames[match.group('var')]
+
+        return pattern.sub(replace, contents)
+
+    @staticmethod
+    def _remove_duplicate_imports(contents):
+        lines = []
+        imports = set()
+        for line in contents.splitlines(keepends=True):
+            if line.startswith('import'):
+                if line.rstrip() in imports:
+                    continue
+                imports.add(line.rstrip())
+            lines.append(line)
+        return ''.join(lines)
 
     def _remove_duplicate_models(self, source_root):
         full_paths = glob.glob(source_root + '/**/*.java', recursive=True)
@@ -158,38 +215,160 @@ class JavaHandler(LaunguageHandlerBase):
                 if fileExt == '.java':
                     files[fileName] = path
 
-        total_duplicate_classes = 0
-        total_updated_files = 0
+        # Read every file once and index which files mention which identifiers
+        contents = {}
+        identifier_index = {}
+        for fileName, filePath in files.items():
+            contents[fileName] = read_file(filePath)
+            for identifier in set(re.findall(r"[A-Za-z_][A-Za-z0-9_]*", contents[fileName])):
+                identifier_index.setdefault(identifier, []).append(fileName)
+
+        # Find all the duplicates first by grouping the model classes of each package on their fingerprint. Merging
+        # one set of duplicates can make the classes that use them identical as well, so repeat until nothing new is
+        # found. Each round fingerprints the classes as they will look once the duplicates found so far are renamed.
+        class_renames = {}
+        var_renames = {}
+        pattern = None
         duplicates = set()
-        for k, v in files.items():
-            next = 2
-            found = True
-            while (found):
-                duplicate_name = k + str(next)
-                found = duplicate_name not in duplicates and duplicate_name in files
-                if found:
-                    if self._check_duplicate_class(k, duplicate_name):
-                        total_duplicate_classes += 1
-                        os.remove(files[duplicate_name])
-                        total_updated_files += self._remove_duplicate_class(files, k, duplicate_name)
-                        duplicates.add(duplicate_name)
-                    next += 1
-
-        for k, v in files.items():
-            duplicate_name = k + 's'
-            found = duplicate_name not in duplicates and duplicate_name in files
-            if found:
-                if self._check_duplicate_class(k, duplicate_name):
-                    total_duplicate_classes += 1
-                    os.remove(files[duplicate_name])
-                    # Don't replace variable names if we've found an "Arrays" class and an "Array" class
-                    total_updated_files += self._remove_duplicate_class(files, k, duplicate_name, False)
-                    duplicates.add(duplicate_name)
-
-
-        print(f"  Found {total_duplicate_classes} duplicate classes")
+        merged = []
+
+        models = sorted(fileName for fileName in files if os.path.basename(os.path.dirname(fileName)) == 'model')
+        found = True
+        while found:
+            found = False
+            candidates = [fileName for fileName in models if fileName not in duplicates]
+            fingerprints = parallel.map_chunks(
+                functools.partial(_fingerprint_classes, pattern=pattern, class_renames=class_renames,
+                                  var_renames=var_renames),
+                [(os.path.basename(fileName), contents[fileName]) for fileName in candidates], self.jobs)
+            groups = {}
+            for fileName, fingerprint in zip(candidates, fingerprints):
+                groups.setdefault((os.path.dirname(fileName), fingerprint), []).append(fileName)
+
+            for group in groups.values():
+                if len(group) == 1:
+                    continue
+                # Keep the shortest name, e.g. Space over Space2 or Array over Arrays
+                original = min(group, key=lambda fileName: (len(fileName), fileName))
+                original_class_name = os.path.basename(original)
+                for duplicate in group:
+                    if duplicate == original:
+                        continue
+                    duplicate_class_name = os.path.basename(duplicate)
+                    self._add_rename(class_renames, original_class_name, duplicate_class_name)
+                    # Variable names are only replaced for the numbered copies the generator creates. A merged class
+                    # with a different name, like Arrays and Array, keeps its variable names.
+                    suffix = duplicate_class_name[len(original_class_name):]
+                    if duplicate_class_name.startswith(original_class_name) and suffix.isdigit():
+                        self._add_rename(var_renames,
+                                         original_class_name[0].lower() + original_class_name[1:],
+                                         duplicate_class_name[0].lower() + duplicate_class_name[1:])
+                    duplicates.add(duplicate)
+                    merged.append((duplicate_class_name, original_class_name))
+                    found = True
+            pattern = self._compile_renames(class_renames, var_renames)
+
+        for duplicate_class_name, original_class_name in merged:
+            print(f"  {'Would merge' if self.dedup_dry_run else 'Merged'} {duplicate_class_name} into {original_class_name}")
+
+        if self.dedup_dry_run:
+            print(f"  Found {len(duplicates)} duplicate classes (dry run, no files changed)")
+            return
+
+        for duplicate_name in duplicates:
+            os.remove(files[duplicate_name])
+
+        # Then rename every reference to them in one pass over the files that mention any of them
+        affected = set()
+        for name in list(class_renames) + list(var_renames):
+            affected.update(identifier_index.get(name, []))
+        affected.difference_update(duplicates)
+
+        affected = sorted(affected)
+        total_updated_files = sum(parallel.map_chunks(
+            functools.partial(_rewrite_renamed_files, pattern=pattern, class_renames=class_renames,
+                              var_renames=var_renames),
+            [(files[fileName], contents[fileName]) for fileName in affected], self.jobs))
+
+        print(f"  Found {len(duplicates)} duplicate classes")
         print(f"  Updated {total_updated_files} files to remove references to duplicates")
 
+    def _hoist_common_models(self, versions, build_output_root_dir):
+        """
+        Move the model classes that are the same in every version, apart from the package name, into the model package
+        of the common artifact, and make the versions use them from there.
+        """
+        placeholder = '__MODEL_PACKAGE__'
+        common_package = self._get_common_model_package()
+        model_dirs = {version: self._get_package_dir(os.path.join(build_output_root_dir, version),
+                                                     self._get_model_package(version))
+                      for version in versions}
+
+        # The contents of each class, with the version's package taken out
+        classes = {}
+        for version, model_dir in model_dirs.items():
+            package = self._get_model_package(version)
+            for path in glob.glob(os.path.join(model_dir, '*.java')):
+                class_name = os.path.splitext(os.path.basename(path))[0]
+                classes.setdefault(class_name, {})[version] = read_file(path).replace(package, placeholder)
+
+        hoisted = set(class_name for class_name, contents in classes.items()
+                      if len(contents) == len(versions) and len(set(contents.values())) == 1)
+
+        # Classes in the common artifact can't use the ones that stay in the versions. Leave out the classes that use
+        # any of them, which can leave out more, until the hoisted classes only use each other.
+        identifiers = {class_name: set(re.findall(r"[A-Za-z_][A-Za-z0-9_]*", classes[class_name][versions[0]]))
+                       for class_name in hoisted}
+        found = True
+        while found:
+            found = False
+            for class_name in sorted(hoisted):
+                if any(identifier in classes and identifier not in hoisted for identifier in identifiers[class_name]):
+                    hoisted.discard(class_name)
+                    found = True
+
+        if len(hoisted) == 0:
+            print("  No model classes are the same in every version")
+            return
+
+        common_model_dir = self._get_package_dir(os.path.join(build_output_root_dir, "common"), common_package)
+        os.makedirs(common_model_dir, exist_ok=True)
+        for class_name in sorted(hoisted):
+            write_file(os.path.join(common_model_dir, class_name + '.java'),
+                       classes[class_name][versions[0]].replace(placeholder, common_package))
+        print(f"  Hoisted {len(hoisted)} model classes into {common_model_dir}")
+
+        names = '|'.join(re.escape(class_name) for class_name in sorted(hoisted, key=len, reverse=True))
+        for version, model_dir in model_dirs.items():
+            package = self._get_model_package(version)
+            for class_name in hoisted:
+                os.remove(os.path.join(model_dir, class_name + '.java'))
+
+            # Fully qualified names and single type imports are pointed at the common package. The classes of the
+            # model package, and anything importing all of it, used the hoisted classes without an import and need one.
+            qualified = re.compile(f"(?<![A-Za-z0-9_.]){re.escape(package)}\\.({names})(?![A-Za-z0-9_])")
+            package_import = re.compile(f"^import\\s+{re.escape(package)}\\.\\*\\s*;", re.MULTILINE)
+            updated_files = 0
+            for path in glob.glob(os.path.join(build_output_root_dir, version, 'src', '**', '*.java'), recursive=True):
+                contents = read_file(path)
+                new_contents = qualified.sub(f"{common_package}.\\1", contents)
+                if os.path.dirname(path) == model_dir or package_import.search(new_contents):
+                    imported = set(re.findall(r"^import\s+[\w.]+\.(\w+)\s*;", new_contents, re.MULTILINE))
+                    used = set(re.findall(r"[A-Za-z_][A-Za-z0-9_]*", new_contents)) & hoisted
+                    imports = ''.join(f"import {common_package}.{class_name};\n"
+                                      for class_name in sorted(used - imported))
+                    new_contents = re.sub(r"^package\s+[\w.]+\s*;\n", lambda match: match.group(0) + imports,
+                                          new_contents, count=1, flags=re.MULTILINE)
+                if new_contents != contents:
+                    write_file(path, self._remove_duplicate_imports(new_contents))
+                    updated_files += 1
+            print(f"  Updated {updated_files} files of version {version}")
+
+    def common_dir(self, build_output_root_dir):
+        if self.product != 'flasharray':
+            return None
+        return os.path.join(build_output_root_dir, "common")
+
     def generate_configs(self, config_dir, language, versions, artifact_version):
         """Generate the config files used for this language for each version"""
         # Write configs
@@ -215,13 +394,17 @@ class JavaHandler(LaunguageHandlerBase):
         :param working_dir: temp directory for staging work
         :param build_output_root_dir: target directory for output packages
         :param artifact_version: version of this artifact for package managers
-        :param first_version: True if this is the first version generated. Useful for tasks that only
-        need to be run once for all versions
+        :param first_version: True for the lowest version in the target directory, if it is being built. Useful for
+        tasks that only need to be run once for all versions, like extracting the artifact in common_dir
 
         :return:
         """
         print("Fixing Java compilation issues")
-        self._fix_java_compilation_issues(working_dir)
+        # Only this version's output. The output of earlier versions has been fixed already, and later versions may
+        # still be generating into working_dir when built in parallel.
+        with instrumentation.stage("fix java compilation issues", version=version):
+            changed_files = self._fix_java_compilation_issues(generator_output_dir)
+        print(f"  Updated {changed_files} files")
 
         # The readme has very wrong documentation. Remove it to prevent confusion
         os.remove(os.path.join(generator_output_dir, "README.md"))
@@ -229,31 +412,101 @@ class JavaHandler(LaunguageHandlerBase):
         if self.product == 'flasharray':
             if first_version:
                 print("Extracting common classes")
-                # Copy out the common java files to a separate java project
-                common_path = os.path.join(working_dir, "common")
-                shutil.copytree(generator_output_dir, common_path, dirs_exist_ok=True)
-                shutil.rmtree(os.path.join(common_path, "src", "main", "java", "com", "purestorage", "rest", self.product, self._get_version_for_package(version)))
-                tests_path = os.path.join(common_path, "src", "test")
-                if os.path.isdir(tests_path):
-                    shutil.rmtree(tests_path)
-                replace_text(os.path.join(common_path, 'pom.xml'), self._get_artifact_id(version), self.common_artifact_id)
-                replace_text(
-                    os.path.join(common_path, "src", "main", "java", "com", "purestorage", "rest", self.product, "common", "JSON.java"),
-                    f"import {self._get_model_package(version)}.*;", "")
-                common_target_path = os.path.join(build_output_root_dir, "common")
-                os.makedirs(common_target_path)
-                shutil.copytree(common_path, common_target_path, dirs_exist_ok=True)
+                # Stage the common java files as a separate java project, leaving out this version's packages and
+                # the tests
+                with instrumentation.stage("extract common", version=version):
+                    common_path = os.path.join(working_dir, "common")
+                    excluded = [os.path.join(generator_output_dir, "src", "main", "java", "com", "purestorage", "rest",
+                                             self.product, self._get_version_for_package(version)),
+                                os.path.join(generator_output_dir, "src", "test")]
+                    staging.link_tree(generator_output_dir, common_path,
+                                      ignore=lambda directory, entries: [entry for entry in entries
+                                                                         if os.path.join(directory, entry) in excluded])
+                    rewrite_file(os.path.join(common_path, 'pom.xml'), [(self._get_artifact_id(version), self.common_artifact_id)])
+                    rewrite_file(
+                        os.path.join(common_path, "src", "main", "java", "com", "purestorage", "rest", self.product, "common", "JSON.java"),
+                        [(f"import {self._get_model_package(version)}.*;", "")])
+                    self._fix_java_compilation_issues(common_path)
+                    common_target_path = self.common_dir(build_output_root_dir)
+                    # Replace the common module left by an earlier build of this version
+                    if os.path.isdir(common_target_path):
+                        shutil.rmtree(common_target_path)
+                    staging.move_tree(common_path, common_target_path)
 
                 print("Common classes available at: " + common_target_path)
 
             shutil.rmtree(os.path.join(generator_output_dir, "src", "main", "java", "com", "purestorage", "rest", self.product, "common"))
             self._add_common_dependency_to_pom(os.path.join(generator_output_dir, 'pom.xml'), artifact_version)
         print("Removing duplicate models")
-        self._remove_duplicate_models((os.path.join(generator_output_dir, "src")))
+        with instrumentation.stage("remove duplicate models", version=version):
+            self._remove_duplicate_models((os.path.join(generator_output_dir, "src")))
 
+    def finalize(self, versions, build_output_root_dir, artifact_version):
+        """
+        Hoist the model classes that are the same in every version into the common artifact, if enabled
 
-def get_language_handler(product: str, language: str) -> LaunguageHandlerBase:
+        :param versions: the versions built
+        :param build_output_root_dir: target directory for output packages
+        :param artifact_version: version of this artifact for package managers
+        """
+        if not self.hoist_common_models:
+            return
+        if self.product != 'flasharray':
+            print("WARNING: Only flasharray has a common artifact, not hoisting model classes")
+            return
+        if len(versions) < 2:
+            print("Not hoisting model classes, there is only one version")
+            return
+        print("Hoisting model classes shared by all versions")
+        with instrumentation.stage("hoist common models"):
+            self._hoist_common_models(sorted(versions), build_output_root_dir)
+
+
+# The passes of JavaHandler that run on worker processes. Each file is in exactly one chunk, so no two processes
+# write the same file, and the results come back in order.
+
+def _fix_java_files(files):
+    """
+    Apply the Java compilation fixes to each of files
+
+    :return: for each file, whether it changed and its (mtime, size) once fixed
+    """
+    results = []
+    for filename in files:
+        replacements = [(r"@javax.annotation.Generated.+", "")]
+        if os.path.basename(filename).startswith('Array'):
+            replacements.insert(0, (r"import java.util.Arrays\;", ""))
+        changed = rewrite_file(filename, replacements)
+        stat = os.stat(filename)
+        results.append((changed, (stat.st_mtime_ns, stat.st_size)))
+    return results
+
+
+def _fingerprint_classes(classes, pattern, class_renames, var_renames):
+    """Fingerprint of each (class name, contents) pair, as the class will look once the renames are applied"""
+    return [JavaHandler._class_fingerprint(class_name,
+                                           JavaHandler._apply_renames(pattern, class_renames, var_renames, contents))
+            for class_name, contents in classes]
+
+
+def _rewrite_renamed_files(files, pattern, class_renames, var_renames):
+    """
+    Apply the renames to each (path, contents) pair, and write the files that change
+
+    :return: for each file, whether it was written
+    """
+    results = []
+    for path, contents in files:
+        new_contents = JavaHandler._apply_renames(pattern, class_renames, var_renames, contents)
+        if new_contents != contents:
+            # These changes can lead to duplicated import statements. Handle that as well
+            write_file(path, JavaHandler._remove_duplicate_imports(new_contents))
+        results.append(new_contents != contents)
+    return results
+
+
+def get_language_handler(product: str, language: str, **options) -> LaunguageHandlerBase:
     if language == 'java':
-        return JavaHandler(product)
+        return JavaHandler(product, **options)
 
-    return LaunguageHandlerBase(product)
+    return LaunguageHandlerBase(product, **options)
@@ -0,0 +1,102 @@
+# The sample script and documentation are provided AS IS and are not supported by
+# the author or the author's employer, unless otherwise agreed in writing. You bear
+# all risk relating to the use or performance of the sample script and documentation.
+# The author and the author's employer disclaim all express or implied warranties
+# (including, without limitation, any warranties of merchantability, title, infringement
+# or fitness for a particular purpose). In no event shall the author, the author's employer
+# or anyone else involved in the creation, production, or delivery of the scripts be liable
+# for any damages whatsoever arising out of the use or performance of the sample script and
+# documentation (including, without limitation, damages for loss of business profits,
+# business interruption, loss of business information, or other pecuniary loss), even if
+# such person has been advised of the possibility of such damages.
+
+import contextlib
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from scripts import instrumentation
+
+# Fewer items than this per process and a pool costs more than it saves
+MIN_ITEMS_PER_JOB = 20
+# Chunks per process. More chunks balance the load better, fewer repeat less of the work chunks have in common.
+CHUNKS_PER_JOB = 4
+
+# The pool shared by every map_chunks inside a "with pool(jobs)" block, and the number of processes it has
+_shared_pool = None
+_shared_jobs = 0
+_shared_lock = threading.Lock()
+
+
+def _new_pool(jobs):
+    # Forking this process while other threads hold locks could leave the children stuck on them
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                                          else None)
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=context)
+
+
+@contextlib.contextmanager
+def pool(jobs):
+    """
+    Share one pool of jobs processes between every map_chunks inside the with block, from any thread. Steps that run
+    side by side, e.g. the post-processing of versions built in parallel, then use no more than jobs processes
+    between them, and the processes are started once rather than for every call.
+    """
+    global _shared_pool, _shared_jobs
+    if jobs <= 1 or _shared_pool is not None:
+        yield
+        return
+    with _shared_lock:
+        _shared_pool, _shared_jobs = _new_pool(jobs), jobs
+    try:
+        yield
+    finally:
+        with _shared_lock:
+            executor, _shared_pool, _shared_jobs = _shared_pool, None, 0
+        executor.shutdown()
+
+
+def _run_chunk(function, record, chunk):
+    """Run function on a chunk in a worker, returning its usage as well if instrumentation is on in the parent"""
+    if not record:
+        return function(chunk), None
+    return instrumentation.run_in_worker(function, chunk)
+
+
+def map_chunks(function, items, jobs=1):
+    """
+    Run function on chunks of items on a pool of processes. Each chunk is a run of consecutive items, so neighbouring
+    items, e.g. files in the same directory, mostly end up in the same process. Everything is run in this process
+    when jobs is 1 or there are too few items to share.
+
+    function has to be picklable, e.g. a module level function or a functools.partial of one. Items and results should
+    be small, e.g. file names and file contents, rather than large object graphs. The processes are started from a
+    fork server where there is one, so it is safe to call from any thread, e.g. while versions are built in parallel.
+    Inside a "with pool(jobs)" block the chunks run on the shared pool, otherwise on a pool of their own. The file I/O
+    and CPU time of the workers are added to the current instrumentation stage of the calling thread.
+
+    :param function: called with a list of items, returns a list of results of the same length
+    :param jobs: maximum number of processes
+    :return: the results of all the items, in the order of items
+    """
+    items = list(items)
+    with _shared_lock:
+        executor = _shared_pool
+        if executor is not None:
+            jobs = min(jobs, _shared_jobs)
+    jobs = min(jobs, len(items) // MIN_ITEMS_PER_JOB)
+    if jobs <= 1:
+        return function(items)
+
+    chunk_count = min(len(items), jobs * CHUNKS_PER_JOB)
+    bounds = [len(items) * index // chunk_count for index in range(chunk_count + 1)]
+    chunks = [items[start:end] for start, end in zip(bounds, bounds[1:])]
+    results = []
+    task = functools.partial(_run_chunk, function, instrumentation.enabled())
+    with contextlib.nullcontext(executor) if executor is not None else _new_pool(jobs) as executor:
+        for chunk_results, usage in executor.map(task, chunks):
+            results.extend(chunk_results)
+            if usage is not None:
+                instrumentation.add_worker_usage(usage)
+    return results
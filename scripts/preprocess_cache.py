@@ -0,0 +1,75 @@
+# The sample script and documentation are provided AS IS and are not supported by
+# the author or the author's employer, unless otherwise agreed in writing. You bear
+# all risk relating to the use or performance of the sample script and documentation.
+# The author and the author's employer disclaim all express or implied warranties
+# (including, without limitation, any warranties of merchantability, title, infringement
+# or fitness for a particular purpose). In no event shall the author, the author's employer
+# or anyone else involved in the creation, production, or delivery of the scripts be liable
+# for any damages whatsoever arising out of the use or performance of the sample script and
+# documentation (including, without limitation, damages for loss of business profits,
+# business interruption, loss of business information, or other pecuniary loss), even if
+# such person has been advised of the possibility of such damages.
+
+import hashlib
+import json
+import os
+
+from scripts import yaml_utils
+from scripts.build_manifest import code_version
+from scripts.file_utils import read_file, write_file
+from scripts.jar_cache import DEFAULT_CACHE_DIR
+
+DEFAULT_PREPROCESS_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'preprocessed')
+
+
+class PreprocessCache:
+    """
+    On-disk cache of preprocessed yaml files, optionally kept in memory as well.
+
+    An entry is keyed by a hash of the code version, the yaml implementation, the file's path within the swagger tree,
+    the preprocessing steps it goes through, and the contents of the file and of every file it references.
+    Preprocessing is deterministic, so an entry can be reused whenever its key matches. libyaml and the pure Python
+    dumper don't always write the same text, so their entries are kept apart.
+    """
+    def __init__(self, cache_dir=DEFAULT_PREPROCESS_CACHE_DIR, keep_in_memory=False):
+        """
+        :param cache_dir: directory to keep the entries in, None to only keep them in memory
+        :param keep_in_memory: keep every entry read or written in memory as well, e.g. for watch mode
+        """
+        self.cache_dir = cache_dir
+        self._memory = {} if keep_in_memory or cache_dir is None else None
+
+    @staticmethod
+    def key(relative_path, steps, input_hashes):
+        """
+        :param relative_path: path of the file within the swagger tree
+        :param steps: names of the preprocessing steps the file goes through
+        :param input_hashes: (relative path, content hash) of the file and every file its output depends on
+        """
+        description = [code_version(), 'libyaml' if yaml_utils.uses_libyaml() else 'pure-python', relative_path,
+                       sorted(steps), sorted(input_hashes)]
+        return hashlib.sha256(json.dumps(description).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.yaml')
+
+    def get(self, key):
+        """The cached contents for key, or None"""
+        if self._memory is not None and key in self._memory:
+            return self._memory[key]
+        if self.cache_dir is None:
+            return None
+        try:
+            contents = read_file(self._path(key))
+        except FileNotFoundError:
+            return None
+        if self._memory is not None:
+            self._memory[key] = contents
+        return contents
+
+    def put(self, key, contents):
+        if self._memory is not None:
+            self._memory[key] = contents
+        if self.cache_dir is not None:
+            os.makedirs(os.path.dirname(self._path(key)), exist_ok=True)
+            write_file(self._path(key), contents)
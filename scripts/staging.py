@@ -0,0 +1,103 @@
+# The sample script and documentation are provided AS IS and are not supported by
+# the author or the author's employer, unless otherwise agreed in writing. You bear
+# all risk relating to the use or performance of the sample script and documentation.
+# The author and the author's employer disclaim all express or implied warranties
+# (including, without limitation, any warranties of merchantability, title, infringement
+# or fitness for a particular purpose). In no event shall the author, the author's employer
+# or anyone else involved in the creation, production, or delivery of the scripts be liable
+# for any damages whatsoever arising out of the use or performance of the sample script and
+# documentation (including, without limitation, damages for loss of business profits,
+# business interruption, loss of business information, or other pecuniary loss), even if
+# such person has been advised of the possibility of such damages.
+
+import collections
+import errno
+import os
+import shutil
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from scripts import instrumentation
+
+# Staged copies share their data with the original files for as long as nobody writes to them. That is safe because
+# the scripts never write into an existing file: file_utils.write_file replaces the file with a new one, which
+# breaks the link and leaves the original alone.
+
+# ioctl cloning a whole file on Linux filesystems with copy-on-write support, e.g. btrfs and xfs
+_FICLONE = 0x40049409
+
+
+def _reflink(source, destination):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    try:
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+    shutil.copystat(source, destination)
+
+
+def link_tree(source, destination, ignore=None):
+    """
+    Stage a copy of the directory source at destination. Each file is hardlinked if possible, reflinked if not, and
+    only copied when neither works, e.g. across filesystems.
+
+    :param ignore: passed to shutil.copytree
+    :return: a Counter with the number of files that were 'linked', 'reflinked' and 'copied', and of the 'symlinks'
+        that were followed. Symbolic links are staged as the files and directories they point to.
+    """
+    counts = collections.Counter()
+
+    def ignore_names(directory, names):
+        counts['symlinks'] += sum(1 for name in names if os.path.islink(os.path.join(directory, name)))
+        return ignore(directory, names) if ignore is not None else ()
+
+    def stage(src, dst):
+        for method, function in (('linked', os.link), ('reflinked', _reflink)):
+            try:
+                function(src, dst)
+                counts[method] += 1
+                return dst
+            except OSError:
+                pass
+        counts['copied'] += 1
+        instrumentation.add_written(os.path.getsize(src))
+        return shutil.copy2(src, dst)
+
+    shutil.copytree(source, destination, ignore=ignore_names, copy_function=stage, dirs_exist_ok=True)
+    return counts
+
+
+def move_tree(source, destination):
+    """
+    Move the directory source to destination, which must not exist or be empty. The tree is renamed into place, so
+    destination never holds a partial tree. Across filesystems it is first copied next to destination.
+    """
+    if os.path.isdir(destination) and len(os.listdir(destination)) == 0:
+        os.rmdir(destination)
+    parent = os.path.dirname(os.path.abspath(destination))
+    os.makedirs(parent, exist_ok=True)
+    try:
+        os.rename(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    temp_dir = tempfile.mkdtemp(dir=parent, prefix='.' + os.path.basename(destination) + '.')
+    try:
+        shutil.copytree(source, temp_dir, dirs_exist_ok=True)
+        instrumentation.add_tree_written(temp_dir)
+        os.rename(temp_dir, destination)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    shutil.rmtree(source)
@@ -11,51 +11,291 @@
 # such person has been advised of the possibility of such damages.
 
 import argparse
+import functools
+import hashlib
 from typing import List
-from scripts.file_utils import replace_text
+from scripts import instrumentation, parallel
+from scripts.file_utils import read_file, rewrite_file, update_file
 
 import yaml
 from yaml.resolver import Resolver
 import os
+import re
 import glob
 
 
-# Prevent the interpreter from thinking "on" is a boolean
-for ch in "OoYyNn":
-    if len(Resolver.yaml_implicit_resolvers[ch]) == 1:
-        del Resolver.yaml_implicit_resolvers[ch]
+# Resolver table that doesn't treat "on", "yes", "no" and friends as booleans. Only "true" and "false" are.
+_IMPLICIT_RESOLVERS = {}
+for ch, resolvers in Resolver.yaml_implicit_resolvers.items():
+    if ch in "OoYyNn":
+        resolvers = [x for x in resolvers if x[0] != 'tag:yaml.org,2002:bool']
+    if len(resolvers) > 0:
+        _IMPLICIT_RESOLVERS[ch] = resolvers
+
+
+class _QuoteOnKeysMixin:
+    """Double quotes "on" keys, which the YAML 1.1 parser used by Swagger Codegen would otherwise read as a boolean"""
+    def represent_mapping(self, tag, mapping, flow_style=None):
+        node = super().represent_mapping(tag, mapping, flow_style)
+        for key_node, _ in node.value:
+            if key_node.tag == 'tag:yaml.org,2002:str' and key_node.value == 'on':
+                key_node.style = '"'
+        return node
+
+
+class _NoAliasesMixin:
+    """Writes an object that appears more than once in full every time, rather than as an anchor and aliases"""
+    def ignore_aliases(self, data):
+        return True
+
+
+class _PyLoader(yaml.SafeLoader):
+    yaml_implicit_resolvers = _IMPLICIT_RESOLVERS
+
+
+class _PyDumper(_QuoteOnKeysMixin, _NoAliasesMixin, yaml.Dumper):
+    yaml_implicit_resolvers = _IMPLICIT_RESOLVERS
+
+
+if yaml.__with_libyaml__:
+    class _CLoader(yaml.CSafeLoader):
+        yaml_implicit_resolvers = _IMPLICIT_RESOLVERS
+
+    class _CDumper(_QuoteOnKeysMixin, _NoAliasesMixin, yaml.CDumper):
+        yaml_implicit_resolvers = _IMPLICIT_RESOLVERS
+
+    _Loader, _Dumper = _CLoader, _CDumper
+else:
+    _Loader, _Dumper = _PyLoader, _PyDumper
+
+
+def use_pure_python(pure_python=True):
+    """
+    Switch between the libyaml based loader and dumper and the pure Python ones. libyaml is used when it is
+    available unless this is called, or the YAML_UTILS_PURE_PYTHON environment variable is set. Both load the same
+    trees and dump equivalent YAML, but not always the same text: long double-quoted scalars with non-ASCII characters
+    are folded differently.
+    """
+    global _Loader, _Dumper
+    if pure_python or not yaml.__with_libyaml__:
+        _Loader, _Dumper = _PyLoader, _PyDumper
     else:
-        Resolver.yaml_implicit_resolvers[ch] = [x for x in
-                                                Resolver.yaml_implicit_resolvers[ch] if x[0] != 'tag:yaml.org,2002:bool']
+        _Loader, _Dumper = _CLoader, _CDumper
+
+
+def uses_libyaml():
+    """Whether the libyaml based loader and dumper are in use"""
+    return _Loader is not _PyLoader
+
 
+if os.environ.get('YAML_UTILS_PURE_PYTHON'):
+    use_pure_python()
 
-def _process_refs(file):
+
+def _load_yaml(file):
+    instrumentation.add_file_read(file)
     with open(file) as f:
-        yaml_obj = yaml.safe_load(f)
+        text = f.read()
+    yaml_obj = yaml.load(text, Loader=_Loader)
+    # Only anchored nodes can be shared
+    return _break_aliases(yaml_obj) if '&' in text else yaml_obj
+
+
+def _dump_yaml(yaml_obj):
+    return yaml.dump(yaml_obj, Dumper=_Dumper)
+
+
+def _ref_path(file, ref):
+    return os.path.realpath(os.path.join(os.path.dirname(os.path.abspath(file)), ref))
+
 
-        return _traverse_refs(file, yaml_obj)
+def _is_single_ref(items):
+    return len(items) == 1 and isinstance(items[0], dict) and len(items[0]) == 1 and '$ref' in items[0]
 
 
-def _resolve_refs(file, items):
+def _copy_tree(obj):
+    """Copy of the dicts and lists of a yaml tree. Scalars are immutable and shared."""
+    if not isinstance(obj, (dict, list)):
+        return obj
+    copy = dict(obj) if isinstance(obj, dict) else list(obj)
+    stack = [copy]
+    while stack:
+        node = stack.pop()
+        for key, value in (node.items() if isinstance(node, dict) else enumerate(node)):
+            if isinstance(value, dict):
+                node[key] = value = dict(value)
+                stack.append(value)
+            elif isinstance(value, list):
+                node[key] = value = list(value)
+                stack.append(value)
+    return copy
+
+
+def _break_aliases(obj):
+    """
+    Give every alias (*name) in a yaml tree a copy of its own of the anchored dict or list, so that changing the tree in
+    place changes one place only
+
+    :return: obj
+    """
+    stack = [obj] if isinstance(obj, (dict, list)) else []
+    seen = set(id(node) for node in stack)
+    while stack:
+        node = stack.pop()
+        for key, value in (node.items() if isinstance(node, dict) else enumerate(node)):
+            if isinstance(value, (dict, list)):
+                if id(value) in seen:
+                    node[key] = _copy_tree(value)
+                else:
+                    seen.add(id(value))
+                    stack.append(value)
+    return obj
+
+
+def _walk(obj, visitor, done=None):
+    """
+    Walk a yaml tree with an explicit stack instead of recursion, calling visitor on every dict. Dicts are visited
+    before the values in them and in the order of their keys, the same order as a recursive walk. The visitor changes
+    the dict in place, and the values it leaves in the dict are walked next.
+
+    :param visitor: function called with each dict
+    :param done: dicts and lists by id that need no walking, e.g. copies of trees that have been walked already. The
+    visitor can add to it.
+    :return: obj
+    """
+    stack = [obj] if isinstance(obj, (dict, list)) else []
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            visitor(node)
+            node = node.values()
+        # Pushed last to first, so that they come off the stack first to last
+        for value in reversed(node):
+            if isinstance(value, (dict, list)) and (done is None or id(value) not in done):
+                stack.append(value)
+    return obj
+
+
+def _sorted_items(mapping):
+    """The items of mapping in the order yaml.dump writes them: by key, unless the keys can't be compared"""
+    try:
+        return sorted(mapping.items())
+    except TypeError:
+        return list(mapping.items())
+
+
+def _sort_keys(obj):
+    """Sort every dict of a yaml tree in place, as dumping it and loading it back would"""
+    def visit(obj):
+        items = _sorted_items(obj)
+        obj.clear()
+        obj.update(items)
+
+    return _walk(obj, visit)
+
+
+def _find_inlined_refs(file, obj, refs):
+    """Collect the files that will be inlined into obj, i.e. the $refs inside allOf elements"""
+    def visit(obj):
+        v = obj.get('allOf')
+        if isinstance(v, list) and not _is_single_ref(v):
+            for item in v:
+                if isinstance(item, dict) and '$ref' in item:
+                    refs.append(_ref_path(file, item['$ref']))
+
+    _walk(obj, visit)
+    return refs
+
+
+class RefResolver:
+    """
+    Inlines the files referenced inside allOf elements.
+
+    Every file is loaded once and its inlined references are recorded as edges of a file-level reference graph. Files
+    are then resolved in dependency order, each exactly once, and the results are reused by every file that
+    references them. Each file inlining a resolved one gets a copy of it, which the file can modify. The resolved
+    objects themselves must not be modified while other files are still being resolved.
+
+    :param load: function returning the contents of a file. Defaults to loading the file from disk
+    """
+    def __init__(self, load=None):
+        self._load = load or _load_yaml
+        self._loaded = {}
+        self._graph = {}
+        self._resolved = {}
+
+    def add_files(self, files):
+        """Load the given files and everything they inline into the reference graph"""
+        pending = [os.path.realpath(file) for file in files]
+        while pending:
+            file = pending.pop()
+            if file in self._graph:
+                continue
+            self._loaded[file] = self._load(file)
+            self._graph[file] = _find_inlined_refs(file, self._loaded[file], [])
+            pending.extend(self._graph[file])
+
+    def _resolution_order(self, file):
+        """Files that need resolving before file can be, dependencies first. Raises on circular references."""
+        order = []
+        ordered = set()
+        visiting = [file]
+        stack = [(file, iter(self._graph[file]))]
+        while stack:
+            current, deps = stack[-1]
+            dep = next(deps, None)
+            if dep is None:
+                stack.pop()
+                visiting.pop()
+                order.append(current)
+                ordered.add(current)
+            elif dep in visiting:
+                cycle = visiting[visiting.index(dep):] + [dep]
+                raise Exception("Circular allOf reference: " + " -> ".join(cycle))
+            elif dep not in self._resolved and dep not in ordered:
+                visiting.append(dep)
+                stack.append((dep, iter(self._graph[dep])))
+        return order
+
+    def resolve(self, file):
+        """Return the contents of file with all allOf references inlined"""
+        file = os.path.realpath(file)
+        if file not in self._resolved:
+            self.add_files([file])
+            for dep in self._resolution_order(file):
+                self._resolved[dep] = _traverse_refs(dep, self._loaded.pop(dep), self)
+        return self._resolved[file]
+
+
+def _resolve_refs(file, items, resolver, done):
+    """
+    Merge the elements of an allOf into a single dict, inlining their references.
+
+    :param done: the dicts and lists the walk of _traverse_refs can skip. The copies of resolved files are added to it.
+    """
     new_dict = {}
-    if len(items) == 1 and isinstance(items[0], dict) and len(items[0]) == 1 and '$ref' in items[0]:
+    if _is_single_ref(items):
         # This allof contains a single ref. No need to inline, just remove the allof
         return {'$ref': items[0]['$ref']}
     for item in items:
         if isinstance(item, dict):
             for k, v in item.items():
                 if k == '$ref':
-                    ref_file = os.path.realpath(os.path.join(os.path.dirname(os.path.abspath(file)), v))
-                    ref_dict = _process_refs(ref_file)
+                    # The resolved file is shared with every other file inlining it, this file gets a copy of its own
+                    ref_dict = _copy_tree(resolver.resolve(_ref_path(file, v)))
 
                     for kr, vr in ref_dict.items():
                         if kr in new_dict and isinstance(vr, dict) and isinstance(new_dict[kr], dict):
-                            new_dict[kr] = {**new_dict[kr], **vr}
+                            new_dict[kr].update(vr)
                         else:
                             new_dict[kr] = vr
+                            if isinstance(vr, (dict, list)):
+                                done[id(vr)] = vr
                 else:
                     if k in new_dict and isinstance(v, dict) and isinstance(new_dict[k], dict):
-                        new_dict[k] = {**new_dict[k], **v}
+                        new_dict[k].update(v)
+                        # Now partly the file's own, which may have allOfs to inline
+                        done.pop(id(new_dict[k]), None)
                     else:
                         new_dict[k] = v
         else:
@@ -63,54 +303,28 @@ def _resolve_refs(file, items):
     return new_dict
 
 
-def _traverse_refs(file, obj):
-    if isinstance(obj, list):
-        new_list = []
-        for li in obj:
-            new_list.append(_traverse_refs(file, li))
-        return new_list
-    elif isinstance(obj, dict):
-        new_dict = {}
-        changed = True
-        while changed:
-            changed = False
-            for k, v in obj.items():
-                if k == 'allOf' and isinstance(v, list):
-                    ref_dict = _resolve_refs(file, v)
-                    del obj['allOf']
-                    obj = {**obj, **ref_dict}
-                    changed = True
-                    break
-
-        for k, v in obj.items():
-                new_dict[k] = _traverse_refs(file, v)
-
-        return new_dict
-    else:
-        return obj
-
+def _traverse_refs(file, obj, resolver):
+    """Inline the allOf elements of obj in place. obj must belong to file alone, e.g. be freshly loaded."""
+    done = {}
 
-def _fix_required(file):
-    with open(file) as f:
-        yaml_obj = yaml.safe_load(f)
+    def visit(obj):
+        # Inlining can bring in another allOf, from an element that has one of its own
+        while isinstance(obj.get('allOf'), list):
+            obj.update(_resolve_refs(file, obj.pop('allOf'), resolver, done))
 
-        yaml_obj = _traverse_required(yaml_obj)
-        return yaml_obj
+    return _walk(obj, visit, done)
 
 
 def _traverse_required(obj):
-    if isinstance(obj, list):
-        new_list = []
-        for li in obj:
-            new_list.append(_traverse_required(li))
-        return new_list
-    elif isinstance(obj, dict):
+    """Convert the "required: true" of properties to a "required" list on their object, in place"""
+    def visit(obj):
         # Check if this defines an object
         if 'type' in obj and obj['type'] == 'object':
-            # loop through the properties and check if they have 'required = true'
+            # loop through the properties and check if they have 'required = true'. Inlining leaves them in the order
+            # they were merged in, the list keeps the order they are written in.
             required_props = []
             if 'properties' in obj:
-                for k, v in obj['properties'].items():
+                for k, v in _sorted_items(obj['properties']):
                     if 'required' in v and v['required'] == True:
                         required_props.append(k)
                         del v['required']
@@ -118,48 +332,77 @@ def _traverse_required(obj):
             if len(required_props) > 0:
                 obj['required'] = required_props
 
-        for k, v in obj.items():
-            obj[k] = _traverse_required(v)
-
-        return obj
-    else:
-        return obj
-
+    return _walk(obj, visit)
 
-def _normalize_relative_refs(file):
-    with open(file) as f:
-        yaml_obj = yaml.safe_load(f)
 
-        yaml_obj = _traverse_relative_refs(file, yaml_obj)
-        return yaml_obj
+def _traverse_relative_refs(file, obj):
+    """Make every $ref in obj relative to the root of the swagger tree, in place"""
+    def visit(obj):
+        v = obj.get('$ref')
+        if isinstance(v, str) and not v.startswith('../'):
+            obj['$ref'] = os.path.join("../../", os.path.relpath(os.path.join(os.path.dirname(file), v), os.path.join(os.path.dirname(file), "../../")))
 
+    return _walk(obj, visit)
 
-def _traverse_relative_refs(file, obj):
-    if isinstance(obj, list):
-        new_list = []
-        for li in obj:
-            new_list.append(_traverse_relative_refs(file, li))
-        return new_list
-    elif isinstance(obj, dict):
-        # Check if this defines an object
-        for k, v in obj.items():
-            if k == '$ref' and not v.startswith('../'):
-                obj[k] = os.path.join("../../", os.path.relpath(os.path.join(os.path.dirname(file), v), os.path.join(os.path.dirname(file), "../../")))
-            else:
-                obj[k] = _traverse_relative_refs(file, v)
 
-        return obj
-    else:
-        return obj
+# A $ref to another file, as it appears in the text of a yaml file. References within the same file ('#/...') and the
+# fragment part of a reference are not captured.
+_REF_PATTERN = re.compile(r"""\$ref['"]?\s*:\s*['"]?([^'"\s#,}\]]+)""")
 
 
-def process_paths(paths: List):
+class ReferenceIndex:
     """
-    Find all files in the given path and inline the contents of any referenced files
-
-    :param paths: A list of path objects
-    :return:
+    The $ref edges between yaml files, in both directions. Files are scanned for references as text, which is much
+    cheaper than parsing them, and each file is scanned at most once.
     """
+    def __init__(self):
+        self._refs = {}
+        self._referrers = {}
+
+    def refs(self, file):
+        """Real paths of the files referenced from file"""
+        file = os.path.realpath(file)
+        if file not in self._refs:
+            with open(file, 'rb') as f:
+                data = f.read()
+            instrumentation.add_read(len(data))
+            text = data.decode('utf-8', 'surrogateescape')
+            self._refs[file] = sorted(set(_ref_path(file, ref) for ref in _REF_PATTERN.findall(text)))
+            for ref in self._refs[file]:
+                self._referrers.setdefault(ref, set()).add(file)
+        return self._refs[file]
+
+    def add_files(self, files):
+        """Scan the given files, so that they are known to referrers()"""
+        for file in files:
+            self.refs(file)
+
+    def referrers(self, file):
+        """Real paths of the files scanned so far that reference file"""
+        return sorted(self._referrers.get(os.path.realpath(file), ()))
+
+    def forget(self, files):
+        """Drop the references of the given files, e.g. because they changed. They are scanned again when needed."""
+        for file in files:
+            file = os.path.realpath(file)
+            for ref in self._refs.pop(file, ()):
+                self._referrers[ref].discard(file)
+
+    def closure(self, files):
+        """The given files and every file they reference, directly or indirectly. Missing files are left out."""
+        closure = set()
+        pending = [os.path.realpath(file) for file in files]
+        while pending:
+            file = pending.pop()
+            if file in closure or not os.path.isfile(file):
+                continue
+            closure.add(file)
+            pending.extend(self.refs(file))
+        return closure
+
+
+def find_yaml_files(paths):
+    """Real paths of all the yaml files in the given files and directories, sorted"""
     full_paths = [os.path.join(os.getcwd(), path) for path in paths]
     files = set()
 
@@ -167,64 +410,208 @@ def process_paths(paths: List):
         if os.path.isfile(path):
             fileName, fileExt = os.path.splitext(path)
             if fileExt == '.yaml':
-                files.add(path)
+                files.add(os.path.realpath(path))
         else:
             full_paths += glob.glob(path + '/*')
 
-    # Normalized references to all be relative from same location
-    for file in files:
-        yaml_obj = _normalize_relative_refs(file)
-        yaml_out = yaml.dump(yaml_obj)
-        with open(file, "w") as f:
-            f.write(yaml_out)
+    return sorted(files)
+
+
+def _version_dir(file):
+    """The directory a file of a version lives in, e.g. FA2.1 for models/FA2.1/volume.yaml"""
+    return os.path.basename(os.path.dirname(file))
+
+
+def _without_version_dir(text, version_dir):
+    """text with every path segment naming version_dir replaced by a placeholder that can't occur in yaml"""
+    return text.replace('/' + version_dir + '/', '/\0/')
+
+
+class _VersionNeutralSignatures:
+    """
+    Signatures of files that are equal for two files exactly when processing them gives the same output apart from
+    the name of their version directory. The signature covers the file and every file it references, with their
+    paths relative to the root of the swagger tree and their contents, all with the file's own version directory
+    taken out. Files are laid out as <root>/<models|responses|...>/<version dir>/<file>, the same layout the
+    normalization of relative references relies on.
+    """
+    def __init__(self, file_set):
+        self._file_set = file_set
+        self._reference_index = ReferenceIndex()
+        self._contents = {}
+        self._hashes = {}
+
+    def _hash(self, file, version_dir, root):
+        key = (file, version_dir)
+        if key not in self._hashes:
+            if file not in self._contents:
+                self._contents[file] = read_file(file)
+            path = '/' + os.path.relpath(file, root).replace(os.sep, '/')
+            description = [_without_version_dir(path, version_dir),
+                           _without_version_dir(self._contents[file], version_dir), file in self._file_set]
+            self._hashes[key] = hashlib.sha256(repr(description).encode('utf-8', 'surrogateescape')).hexdigest()
+        return self._hashes[key]
+
+    def get(self, file):
+        version_dir = _version_dir(file)
+        root = os.path.dirname(os.path.dirname(os.path.dirname(file)))
+        hashes = sorted(self._hash(dep, version_dir, root) for dep in self._reference_index.closure([file]))
+        return hashlib.sha256(' '.join([self._hash(file, version_dir, root)] + hashes).encode('ascii')).hexdigest()
+
+
+def _process_files(files, file_set, pure_python=False):
+    """
+    Inline the references of files and convert their required properties, returning the contents to write to each
+    file. Run in the worker processes of process_paths, so it takes and returns nothing but file names and text.
+
+    :param file_set: the files whose references are normalized when they are loaded
+    :param pure_python: use the pure Python loader and dumper, which a worker process doesn't know otherwise
+    """
+    if pure_python:
+        use_pure_python()
+
+    # Normalize references to all be relative from same location. Inlining reads the normalized version of any file
+    # in the given paths, as it would be written out, i.e. with sorted keys, and files outside of them as they are on
+    # disk. Key order decides which value wins when an allOf element has both a $ref and keys of its own.
+    def load(file):
+        yaml_obj = _load_yaml(file)
+        if file in file_set:
+            yaml_obj = _sort_keys(_traverse_relative_refs(file, yaml_obj))
+        return yaml_obj
 
     # Inline appropriate references in the given paths
-    for file in files:
-        yaml_obj = _process_refs(file)
-        yaml_out = yaml.dump(yaml_obj)
-        with open(file, "w") as f:
-            f.write(yaml_out)
+    with instrumentation.stage("load files"):
+        resolver = RefResolver(load)
+        resolver.add_files(files)
+    with instrumentation.stage("inline references"):
+        yaml_objs = [resolver.resolve(file) for file in files]
 
     # Once references have been inlined, we need to convert from the old "required: true" style for properties to
-    # the new "required: [ "a", "b", "c" ]" style
-    for file in files:
-        yaml_obj = _fix_required(file)
-        yaml_out = yaml.dump(yaml_obj)
-        with open(file, "w") as f:
-            f.write(yaml_out)
+    # the new "required: [ "a", "b", "c" ]" style. Every file has been resolved at this point, so the resolved
+    # objects can be modified in place.
+    with instrumentation.stage("dump files"):
+        return [_dump_yaml(_traverse_required(yaml_obj)) for yaml_obj in yaml_objs]
 
-    # Do any text replacing needed
-    for file in files:
-        # Handle properties with a truthy value for a name
-        replace_text(file, ' on:', ' "on":')
 
+def process_paths(paths: List, only=None, jobs=1):
+    """
+    Find all files in the given path and inline the contents of any referenced files
 
-def rename_array_yaml(paths: List):
-    full_paths = [os.path.join(os.getcwd(), path) for path in paths]
-    files = set()
+    Each file is loaded once, run through all the stages in memory and written once. Files that are the same as a file
+    of another version apart from the version directory, and so are the files they reference, are only processed
+    once; the others get a copy of the output with their own version directory put into the references.
 
-    for path in full_paths:
-        if os.path.isfile(path):
-            fileName, fileExt = os.path.splitext(path)
-            if fileExt == '.yaml':
-                files.add(path)
-        else:
-            full_paths += glob.glob(path + '/*')
+    With several jobs, the files are processed in chunks on a pool of processes. Each process loads whatever its
+    chunk inlines and sends back the text to write, which is written from this process, so the output is the same
+    whatever the number of jobs.
+
+    :param paths: A list of path objects
+    :param only: if given, only these files are processed and written. The other files in paths are still read,
+    as needed, to inline them.
+    :param jobs: number of processes to process files on
+    :return: the number of files whose output was copied from another version
+    """
+    files = find_yaml_files(paths)
+    file_set = set(files)
+    if only is not None:
+        only = set(os.path.realpath(file) for file in only)
+        files = [file for file in files if file in only]
+
+    # Group the files that can share their output, the first file of each group is processed
+    with instrumentation.stage("group shared files"):
+        signatures = _VersionNeutralSignatures(file_set)
+        groups = {}
+        for file in files:
+            groups.setdefault(signatures.get(file), []).append(file)
+        files = [group[0] for group in groups.values()]
+
+    with instrumentation.stage("process files", jobs=jobs):
+        outputs = parallel.map_chunks(functools.partial(_process_files, file_set=file_set,
+                                                        pure_python=not uses_libyaml()), files, jobs)
+
+    shared = 0
+    with instrumentation.stage("write files"):
+        for group, contents in zip(groups.values(), outputs):
+            update_file(group[0], contents)
+            version_dir = _version_dir(group[0])
+            for file in group[1:]:
+                update_file(file, contents.replace('/' + version_dir + '/', '/' + _version_dir(file) + '/'))
+                shared += 1
+    return shared
+
+
+def _mentions(file, text):
+    with open(file, 'rb') as f:
+        data = f.read()
+    instrumentation.add_read(len(data))
+    return text in data
+
+
+def rename_files(renames, reference_index, only=None):
+    """
+    Rename files and update the references to them. Only the files that reference a renamed file are rewritten, and
+    only the references that point at it are changed.
+
+    :param renames: dict of the real path of each file to rename to its new path
+    :param reference_index: ReferenceIndex that has scanned every file whose references need updating
+    :param only: if given, only references in these files are updated
+    """
+    referrers = set()
+    for file in renames:
+        referrers.update(reference_index.referrers(file))
+    if only is not None:
+        referrers &= set(os.path.realpath(file) for file in only)
+
+    for referrer in sorted(referrers):
+        def replace(match):
+            ref = match.group(1)
+            target = _ref_path(referrer, ref)
+            if target not in renames:
+                return match.group(0)
+            # Keep the reference as it was written, apart from the file name, when the file stays in its directory
+            if os.path.dirname(renames[target]) == os.path.dirname(target) and \
+                    os.path.basename(ref) == os.path.basename(target):
+                new_ref = ref[:len(ref) - len(os.path.basename(target))] + os.path.basename(renames[target])
+            else:
+                new_ref = os.path.relpath(renames[target], os.path.dirname(referrer)).replace(os.sep, '/')
+            return match.group(0)[:match.start(1) - match.start(0)] + new_ref
+
+        rewrite_file(referrer, [(_REF_PATTERN, replace)])
+
+    for file, new_file in renames.items():
+        os.rename(file, new_file)
+
+
+def rename_array_yaml(paths: List, only=None):
+    """
+    Rename files named array.yaml to arrays.yaml and update the references to them
+
+    :param paths: A list of path objects
+    :param only: if given, only references in these files are updated. All array.yaml files in paths are renamed.
+    """
+    files = find_yaml_files(paths)
+    # Files named "array" cause problems with... arrays
+    renames = {file: os.path.join(os.path.dirname(file), 'arrays.yaml')
+               for file in files if os.path.basename(file) == 'array.yaml'}
+    if len(renames) == 0:
+        return
 
-    # Do any text replacing needed
-    for file in files:
-        # Files named "array" cause problems with... arrays
-        replace_text(file, r'/array\.yaml', '/arrays.yaml')
-        if os.path.basename(file) == 'array.yaml':
-            os.rename(file, os.path.join(os.path.dirname(file), 'arrays.yaml'))
+    # Only the files mentioning the name can reference an array.yaml, the others needn't be scanned
+    reference_index = ReferenceIndex()
+    reference_index.add_files(file for file in files if _mentions(file, b'array.yaml'))
+    rename_files(renames, reference_index, only)
 
 
 def main():
     parser = argparse.ArgumentParser(description='Replace $ref= instances in yaml files with the contents of the reference')
     parser.add_argument('path', nargs='+', help='List of files or paths to process.')
+    parser.add_argument('--pure-python', action='store_true', help="Don't use libyaml even if it is available.")
+    parser.add_argument('--jobs', type=int, default=1, help='Number of processes to process files on. Defaults to 1.')
 
     args = parser.parse_args()
-    process_paths(args.path)
+    if args.pure_python:
+        use_pure_python()
+    process_paths(args.path, jobs=args.jobs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,131 @@
+# The sample script and documentation are provided AS IS and are not supported by
+# the author or the author's employer, unless otherwise agreed in writing. You bear
+# all risk relating to the use or performance of the sample script and documentation.
+# The author and the author's employer disclaim all express or implied warranties
+# (including, without limitation, any warranties of merchantability, title, infringement
+# or fitness for a particular purpose). In no event shall the author, the author's employer
+# or anyone else involved in the creation, production, or delivery of the scripts be liable
+# for any damages whatsoever arising out of the use or performance of the sample script and
+# documentation (including, without limitation, damages for loss of business profits,
+# business interruption, loss of business information, or other pecuniary loss), even if
+# such person has been advised of the possibility of such damages.
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import build
+from scripts import build_manifest
+
+VERSIONS = ['2.0', '2.1', '2.2']
+
+
+class StubBuildTest(unittest.TestCase):
+    """build() with the stub codegen backend, which needs no Java"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.source = os.path.join(self.root, 'source')
+        for version in VERSIONS:
+            self._write(os.path.join('specs', f"FA{version}.spec.yaml"), '\n'.join([
+                "swagger: '2.0'",
+                'paths:',
+                '  /volumes:',
+                '    get:',
+                '      responses:',
+                "        '200':",
+                '          schema:',
+                f"            $ref: '../models/FA{version}/volume.yaml'",
+            ]) + '\n')
+            self._write(os.path.join('models', f"FA{version}", 'volume.yaml'),
+                        'type: object\nproperties:\n  name:\n    type: string\n')
+        self.swagger_jar = os.path.join(self.root, 'swagger-codegen-cli.jar')
+        with open(self.swagger_jar, 'w') as f:
+            f.write('not a jar, the stub backend never runs it\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, contents):
+        path = os.path.join(self.source, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def _build(self, target, versions=None, hoist_common_models=False):
+        """Build into the directory target under the test's root, and return the log"""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            build.build(self.source, os.path.join(self.root, target), 'flasharray', 'java', versions, None, 'java',
+                        '1.0.0', swagger_jar=self.swagger_jar, codegen_backend='stub',
+                        handler_options={'hoist_common_models': hoist_common_models})
+        return output.getvalue()
+
+    def _read_tree(self, target):
+        """The files of a target directory by relative path, leaving out the manifests"""
+        tree = {}
+        target = os.path.join(self.root, target)
+        for root, _, entries in os.walk(target):
+            for entry in entries:
+                if entry != build_manifest.MANIFEST_FILE:
+                    with open(os.path.join(root, entry)) as f:
+                        tree[os.path.relpath(os.path.join(root, entry), target)] = f.read()
+        return tree
+
+    def _common_model(self, target):
+        return os.path.join(self.root, target, 'common', 'src', 'main', 'java', 'com', 'purestorage', 'rest',
+                            'flasharray', 'common', 'model', 'StubModel.java')
+
+    def test_full_build(self):
+        log = self._build('out')
+        for version in VERSIONS:
+            self.assertIsNotNone(build_manifest.read_manifest(os.path.join(self.root, 'out', version)))
+        self.assertEqual(log.count("Extracting common classes"), 1)
+        self.assertEqual(build_manifest.read_manifest(os.path.join(self.root, 'out', 'common'))['version'], '2.0')
+        self.assertIn(os.path.join('2.1', 'src', 'main', 'java', 'com', 'purestorage', 'rest', 'flasharray', 'v2_1',
+                                   'model', 'StubModel.java'), self._read_tree('out'))
+
+    def test_rerun_is_up_to_date(self):
+        self._build('out')
+        log = self._build('out')
+        self.assertEqual(log.count("is up to date"), len(VERSIONS))
+        self.assertNotIn("Generating client", log)
+
+    def test_changed_input_rebuilds_only_that_version(self):
+        self._build('out')
+        self._write(os.path.join('models', 'FA2.1', 'volume.yaml'),
+                    'type: object\nproperties:\n  name:\n    type: string\n    description: Changed\n')
+        log = self._build('out')
+        self.assertIn("Inputs of version 2.1 changed", log)
+        self.assertEqual(log.count("Generating client for version"), 1)
+        # The common artifact comes from 2.0, like in a clean build
+        self.assertNotIn("Extracting common classes", log)
+        self._build('clean')
+        self.assertEqual(self._read_tree('out'), self._read_tree('clean'))
+
+    def test_partial_build_with_hoisting_keeps_the_other_versions(self):
+        self._build('out', hoist_common_models=True)
+        self.assertTrue(os.path.isfile(self._common_model('out')))
+        log = self._build('out', versions=['2.1'], hoist_common_models=True)
+        self.assertEqual(log.count("is up to date"), len(VERSIONS))
+        self.assertTrue(os.path.isfile(self._common_model('out')))
+
+        self._write(os.path.join('models', 'FA2.1', 'volume.yaml'),
+                    'type: object\nproperties:\n  name:\n    type: string\n    description: Changed\n')
+        self._build('out', versions=['2.1'], hoist_common_models=True)
+        self._build('clean', hoist_common_models=True)
+        self.assertEqual(self._read_tree('out'), self._read_tree('clean'))
+
+    def test_build_without_hoisting_refuses_to_drop_hoisted_classes(self):
+        self._build('out', hoist_common_models=True)
+        with self.assertRaises(Exception):
+            self._build('out', versions=['2.0'])
+        self.assertTrue(os.path.isfile(self._common_model('out')))
+        self.assertIsNotNone(build_manifest.read_manifest(os.path.join(self.root, 'out', '2.0')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# The sample script and documentation are provided AS IS and are not supported by
+# the author or the author's employer, unless otherwise agreed in writing. You bear
+# all risk relating to the use or performance of the sample script and documentation.
+# The author and the author's employer disclaim all express or implied warranties
+# (including, without limitation, any warranties of merchantability, title, infringement
+# or fitness for a particular purpose). In no event shall the author, the author's employer
+# or anyone else involved in the creation, production, or delivery of the scripts be liable
+# for any damages whatsoever arising out of the use or performance of the sample script and
+# documentation (including, without limitation, damages for loss of business profits,
+# business interruption, loss of business information, or other pecuniary loss), even if
+# such person has been advised of the possibility of such damages.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+from scripts import yaml_utils
+
+
+class ProcessPathsTest(unittest.TestCase):
+    """process_paths on files whose keys aren't in alphabetical order"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.models = os.path.join(self.root, 'models', 'FA2.0')
+        os.makedirs(self.models)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, name, contents):
+        with open(os.path.join(self.models, name), 'w') as f:
+            f.write(contents)
+
+    def _process(self):
+        yaml_utils.process_paths([os.path.join(self.root, 'models', 'FA2.0')])
+
+    def _read(self, name):
+        with open(os.path.join(self.models, name)) as f:
+            return yaml.safe_load(f)
+
+    def test_required_list_is_sorted(self):
+        self._write('plain.yaml', '\n'.join([
+            'type: object',
+            'properties:',
+            '  name:',
+            '    type: string',
+            '    required: true',
+            '  id:',
+            '    type: integer',
+            '    required: true',
+        ]) + '\n')
+        self._process()
+        plain = self._read('plain.yaml')
+        self.assertEqual(plain['required'], ['id', 'name'])
+        self.assertNotIn('required', plain['properties']['name'])
+
+    def test_inlined_properties_are_required_in_sorted_order(self):
+        self._write('base.yaml', '\n'.join([
+            'type: object',
+            'description: Base',
+            'properties:',
+            '  zeta:',
+            '    type: string',
+            '    required: true',
+        ]) + '\n')
+        self._write('thing.yaml', '\n'.join([
+            'allOf:',
+            "  - $ref: 'base.yaml'",
+            '  - type: object',
+            '    properties:',
+            '      name:',
+            '        type: string',
+            '        required: true',
+            '      id:',
+            '        type: string',
+            '        required: true',
+        ]) + '\n')
+        self._process()
+        self.assertEqual(self._read('thing.yaml')['required'], ['id', 'name', 'zeta'])
+
+    def test_own_keys_of_allof_element_win_over_its_ref(self):
+        # $ref sorts before description, so the element's own description is merged in last
+        self._write('base.yaml', 'type: object\ndescription: Base\n')
+        self._write('thing.yaml', "allOf:\n  - description: Own\n    $ref: 'base.yaml'\n  - type: object\n")
+        self._process()
+        self.assertEqual(self._read('thing.yaml')['description'], 'Own')
+
+    def test_aliases_are_processed_separately(self):
+        self._write('thing.yaml', '\n'.join([
+            'type: object',
+            'properties: &properties',
+            '  name:',
+            '    type: string',
+            '    required: true',
+            'x-other:',
+            '  type: object',
+            '  properties: *properties',
+        ]) + '\n')
+        self._process()
+        thing = self._read('thing.yaml')
+        self.assertEqual(thing['required'], ['name'])
+        self.assertEqual(thing['x-other']['required'], ['name'])
+
+    def test_allof_behind_an_alias_is_inlined_at_each_use(self):
+        self._write('base.yaml', 'type: object\ndescription: Base\n')
+        self._write('thing.yaml', '\n'.join([
+            'type: object',
+            'properties:',
+            '  a: &shared',
+            '    allOf:',
+            "      - $ref: 'base.yaml'",
+            '      - description: A',
+            '  b: *shared',
+            '  c: &plain',
+            '    properties:',
+            '      x:',
+            '        type: string',
+            '  d:',
+            '    allOf:',
+            '      - *plain',
+            '      - properties:',
+            '          y:',
+            '            type: string',
+        ]) + '\n')
+        self._process()
+        properties = self._read('thing.yaml')['properties']
+        self.assertEqual(properties['a'], {'type': 'object', 'description': 'A'})
+        self.assertEqual(properties['b'], properties['a'])
+        self.assertEqual(sorted(properties['c']['properties']), ['x'])
+        self.assertEqual(sorted(properties['d']['properties']), ['x', 'y'])
+
+
+if __name__ == '__main__':
+    unittest.main()